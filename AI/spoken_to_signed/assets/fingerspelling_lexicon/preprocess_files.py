@@ -1,100 +1,233 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import time
 from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
+from typing import Union
 
 from pose_anonymization.appearance import remove_appearance
 from pose_format import Pose
 from pose_format.utils.generic import (
     get_body_hand_wrist_index,
     get_hand_wrist_index,
+    normalize_pose_size,
 )
 from tqdm import tqdm
 
 from spoken_to_signed.gloss_to_pose.concatenate import (
     normalize_pose,
-    scale_normalized_pose,
     trim_pose,
 )
 
 ONLY_RIGHT_HAND = {"ase"}
 
-durations = defaultdict(list)
+MANIFEST_NAME = "manifest.json"
 
-print("MAKE SURE THIS SCRIPT ONLY RUNS ONCE")
 
-for file in tqdm(Path.cwd().rglob("*.pose")):
-    # read the files (597M)
+def file_hash(file: Path) -> str:
+    digest = hashlib.sha1()
     with open(file, "rb") as f:
-        pose = Pose.read(f.read())
-
-    # trim pose (35% saving)
-    pose = trim_pose(pose)
-
-    # log duration
-    durations[file.parent.name].append(len(pose.body.data) / pose.body.fps)
-
-    # Run this transformation only once! floating point instability can change the numbers slightly
-    # if pose.body.data.shape[2] != 576:
-    #     continue
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(block)
+    return digest.hexdigest()
 
-    original_pose = pose
 
-    # # reduce holistic (70% saving)
-    # pose = reduce_holistic(pose)
-
-    # normalize, just for good measure
-    pose = normalize_pose(pose)
-    scale_normalized_pose(pose)
-
-    # remove appearance to be consistent if the person changes
-    pose = remove_appearance(pose)
-
-    # Pose estimation is not perfect, so if we don't need the left hand (For selected languages), we can remove it
-    if file.parent.name in ONLY_RIGHT_HAND:
-        # Remove hand
-        left_hand_index = get_hand_wrist_index(pose, "left")
-        pose.body.data[:, :, left_hand_index : left_hand_index + 21] = 0
-        pose.body.confidence[:, :, left_hand_index : left_hand_index + 21] = 0
-
-        # Remove body wrist
-        left_wrist_index = get_body_hand_wrist_index(pose, "left")
-        pose.body.data[:, :, left_wrist_index] = 0
-        pose.body.confidence[:, :, left_wrist_index] = 0
-
-    # write the file
-    with open(file, "wb") as f:
-        pose.write(f)
+def file_signature(file: Path) -> dict:
+    stat = file.stat()
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
 
-duration_averages = {k: sum(v) / len(v) for k, v in durations.items()}
-for language, duration in duration_averages.items():
-    print(language, duration)
 
-# Heuristically speed up the videos if needed (16MB)
-for file in tqdm(Path.cwd().rglob("*.pose")):
+def measure_file(file: Path) -> dict:
+    """Hashes a source file and measures its duration after trimming, in seconds"""
     with open(file, "rb") as f:
         pose = Pose.read(f.read())
+    pose = trim_pose(pose)
+    duration = len(pose.body.data) / pose.body.fps
+    return {"sha1": file_hash(file), "fps": pose.body.fps, "duration": duration, **file_signature(file)}
 
-    interpolate = False
 
-    original_fps = pose.body.fps
-    interpolation_fps = pose.body.fps
+def interpolation_fps(fps: float, duration_average: float) -> Union[tuple[float, int], None]:
+    """The fps to interpolate to and the fps to store, or `None` if the file keeps its speed"""
+    original_fps = fps
+    target_fps = fps
+    interpolate = False
 
-    if duration_averages[file.parent.name] > 1.1:
+    if duration_average > 1.1:
         # Practically, changes the speed of the video so that the average is 1~ second
-        speed_factor = duration_averages[file.parent.name]
-        interpolation_fps /= speed_factor
+        target_fps /= duration_average
         interpolate = True
 
     if original_fps > 30:
-        interpolation_fps /= 2
+        target_fps /= 2
         original_fps /= 2
         interpolate = True
 
-    interpolation_fps = round(interpolation_fps)
+    return (original_fps, round(target_fps)) if interpolate else None
+
+
+def get_transforms(language: str, fps: float, duration_average: float) -> list[str]:
+    transforms = ["trim", "normalize", "normalize_size", "remove_appearance"]
+    # Pose estimation is not perfect, so if we don't need the left hand (For selected languages), we can remove it
+    if language in ONLY_RIGHT_HAND:
+        transforms.append("remove_left_hand")
+    interpolation = interpolation_fps(fps, duration_average)
+    if interpolation is not None:
+        transforms.append(f"interpolate:{interpolation[1]}:{interpolation[0]}")
+    return transforms
 
-    if interpolate:
-        print("Interpolating", file, interpolation_fps)
 
-        pose = pose.interpolate(interpolation_fps)
-        pose.body.fps = original_fps
-        with open(file, "wb") as f:
-            pose.write(f)
+def process_file(source: Path, target: Path, transforms: list[str]):
+    # read the files (597M)
+    with open(source, "rb") as f:
+        pose = Pose.read(f.read())
+
+    for transform in transforms:
+        name, *args = transform.split(":")
+        if name == "trim":
+            # trim pose (35% saving)
+            pose = trim_pose(pose)
+        elif name == "normalize":
+            pose = normalize_pose(pose)
+        elif name == "normalize_size":
+            normalize_pose_size(pose)
+        elif name == "remove_appearance":
+            # remove appearance to be consistent if the person changes
+            pose = remove_appearance(pose)
+        elif name == "remove_left_hand":
+            left_hand_index = get_hand_wrist_index(pose, "left")
+            pose.body.data[:, :, left_hand_index : left_hand_index + 21] = 0
+            pose.body.confidence[:, :, left_hand_index : left_hand_index + 21] = 0
+
+            left_wrist_index = get_body_hand_wrist_index(pose, "left")
+            pose.body.data[:, :, left_wrist_index] = 0
+            pose.body.confidence[:, :, left_wrist_index] = 0
+        elif name == "interpolate":
+            # Heuristically speed up the videos if needed (16MB)
+            pose = pose.interpolate(int(args[0]))
+            pose.body.fps = float(args[1])
+        else:
+            raise ValueError(f"Unknown transform {transform}")
+
+    # write the file, sources are never overwritten so this is safe to run again
+    target.parent.mkdir(parents=True, exist_ok=True)
+    temporary_target = target.with_name(f"{target.name}.tmp")
+    with open(temporary_target, "wb") as f:
+        pose.write(f)
+    os.replace(temporary_target, target)
+
+
+def read_manifest(output: Path) -> dict:
+    manifest_path = output / MANIFEST_NAME
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, encoding="utf-8") as f:
+        return json.load(f)["files"]
+
+
+def write_manifest(output: Path, files: dict):
+    output.mkdir(parents=True, exist_ok=True)
+    temporary_path = output / f"{MANIFEST_NAME}.tmp"
+    with open(temporary_path, "w", encoding="utf-8") as f:
+        json.dump({"files": files}, f, indent=2, sort_keys=True)
+    os.replace(temporary_path, output / MANIFEST_NAME)
+
+
+def run_parallel(executor: ProcessPoolExecutor, function, jobs: dict, description: str) -> dict:
+    futures = {executor.submit(function, *args): key for key, args in jobs.items()}
+    results = {}
+    for future in tqdm(as_completed(futures), total=len(futures), desc=description):
+        results[futures[future]] = future.result()
+    return results
+
+
+def measure_files(executor: ProcessPoolExecutor, files: dict, manifest: dict) -> tuple[dict, int]:
+    """Measures the trimmed duration of files that are new or changed since the last run"""
+    entries = {}
+    to_measure = {}
+    for name, file in files.items():
+        entry = manifest.get(name)
+        if entry is not None and all(entry.get(k) == v for k, v in file_signature(file).items()):
+            entries[name] = entry
+        else:
+            to_measure[name] = (file,)
+
+    for name, measurement in run_parallel(executor, measure_file, to_measure, "Measuring").items():
+        entry = manifest.get(name, {})
+        if entry.get("sha1") != measurement["sha1"]:
+            entry = {}  # The content changed, not just the modification time
+        entries[name] = {**entry, **measurement}
+    return entries, len(to_measure)
+
+
+def preprocess(source: Path, output: Path, workers: int = None):
+    output = output.resolve()
+    files = {
+        str(file.relative_to(source)): file
+        for file in sorted(source.rglob("*.pose"))
+        if output not in file.resolve().parents  # The output may be inside the source directory
+    }
+    manifest = read_manifest(output)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        start_time = time.time()
+        entries, measured = measure_files(executor, files, manifest)
+        measure_time = time.time() - start_time
+
+        durations = defaultdict(list)
+        for name, entry in entries.items():
+            durations[Path(name).parent.name].append(entry["duration"])
+        duration_averages = {k: sum(v) / len(v) for k, v in durations.items()}
+
+        # Process files whose source or transforms differ from what is already in the output
+        start_time = time.time()
+        to_process = {}
+        for name, file in files.items():
+            language = Path(name).parent.name
+            transforms = get_transforms(language, entries[name]["fps"], duration_averages[language])
+            if entries[name].get("transforms") != transforms or not (output / name).exists():
+                entries[name].pop("transforms", None)
+                to_process[name] = (file, output / name, transforms)
+        for name in run_parallel(executor, process_file, to_process, "Processing"):
+            entries[name]["transforms"] = to_process[name][2]
+        process_time = time.time() - start_time
+
+    write_manifest(output, {name: entries[name] for name in files})
+
+    # The index refers to the files by relative path, so it is valid for the output directory as well
+    index_path = source / "index.csv"
+    if index_path.exists() and index_path.resolve() != (output / "index.csv").resolve():
+        shutil.copyfile(index_path, output / "index.csv")
+
+    print(
+        f"Measured {measured} files in {measure_time:.1f}s, "
+        f"processed {len(to_process)} files in {process_time:.1f}s, "
+        f"{len(files) - len(to_process)} were up to date"
+    )
+    print("language", "files", "mean", "min", "max", sep="\t")
+    for language, language_durations in sorted(durations.items()):
+        print(
+            language,
+            len(language_durations),
+            f"{duration_averages[language]:.2f}s",
+            f"{min(language_durations):.2f}s",
+            f"{max(language_durations):.2f}s",
+            sep="\t",
+        )
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Trim, normalize and anonymize the lexicon poses")
+    args_parser.add_argument("--input", type=str, default=str(Path.cwd()), help="Directory with the downloaded poses")
+    args_parser.add_argument("--output", type=str, required=True, help="Directory for the processed poses")
+    args_parser.add_argument("--workers", type=int, default=None)
+    args = args_parser.parse_args()
+
+    preprocess(Path(args.input), Path(args.output), args.workers)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,8 +8,7 @@ from pose_format import Pose
 
 from spoken_to_signed.gloss_to_pose import (
     CSVPoseLookup,
-    concatenate_poses,
-    gloss_to_pose,
+    glosses_to_pose,
 )
 from spoken_to_signed.gloss_to_pose.lookup.fingerspelling_lookup import (
     FingerspellingPoseLookup,
@@ -25,10 +24,7 @@ def _text_to_gloss(text: str, language: str, glosser: str, **kwargs) -> list[Glo
 def _gloss_to_pose(sentences: list[Gloss], lexicon: str, spoken_language: str, signed_language: str) -> Pose:
     fingerspelling_lookup = FingerspellingPoseLookup()
     pose_lookup = CSVPoseLookup(lexicon, backup=fingerspelling_lookup)
-    poses = [gloss_to_pose(gloss, pose_lookup, spoken_language, signed_language) for gloss in sentences]
-    if len(poses) == 1:
-        return poses[0]
-    return concatenate_poses(poses, trim=False)
+    return glosses_to_pose(sentences, pose_lookup, spoken_language, signed_language)
 
 
 def _get_models_dir():
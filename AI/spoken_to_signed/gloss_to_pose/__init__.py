@@ -3,9 +3,30 @@ from typing import Union
 from pose_format import Pose
 
 from ..text_to_gloss.types import Gloss
-from .concatenate import concatenate_poses
+from .concatenate import concatenate_poses, copy_pose, prepare_pose
+from .config import DEFAULT_CONFIG, PipelineConfig
 from .lookup import CSVPoseLookup as CSVPoseLookup
 from .lookup import PoseLookup
+from .tracing import span
+from .transition_cache import TransitionCache
+
+
+def anonymize_poses(poses: list[Pose], anonymize: Union[bool, Pose]) -> list[Pose]:
+    try:
+        from pose_anonymization.appearance import (
+            remove_appearance,
+            transfer_appearance,
+        )
+    except ImportError as e:
+        raise ImportError(
+            "Please install pose_anonymization. "
+            "pip install git+https://github.com/sign-language-processing/pose-anonymization"
+        ) from e
+
+    with span("anonymize", poses=len(poses), transfer=isinstance(anonymize, Pose)):
+        if isinstance(anonymize, Pose):
+            return [transfer_appearance(pose, anonymize) for pose in poses]
+        return [remove_appearance(pose) for pose in poses]
 
 
 def gloss_to_pose(
@@ -15,29 +36,59 @@ def gloss_to_pose(
     signed_language: str,
     source: str = None,
     anonymize: Union[bool, Pose] = False,
+    config: PipelineConfig = DEFAULT_CONFIG,
+    transition_cache: TransitionCache = None,
 ) -> Pose:
-    # Transform the list of glosses into a list of poses
-    poses = pose_lookup.lookup_sequence(glosses, spoken_language, signed_language, source)
-
-    # Anonymize poses
-    if anonymize:
-        try:
-            from pose_anonymization.appearance import (
-                remove_appearance,
-                transfer_appearance,
-            )
-        except ImportError as e:
-            raise ImportError(
-                "Please install pose_anonymization. "
-                "pip install git+https://github.com/sign-language-processing/pose-anonymization"
-            ) from e
+    with span("gloss_to_pose", glosses=len(glosses)):
+        # Transform the list of glosses into a list of poses
+        poses = pose_lookup.lookup_sequence(glosses, spoken_language, signed_language, source, config)
 
-        if isinstance(anonymize, Pose):
-            print("Transferring appearance...")
-            poses = [transfer_appearance(pose, anonymize) for pose in poses]
-        else:
-            print("Removing appearance...")
-            poses = [remove_appearance(pose) for pose in poses]
-
-    # Concatenate the poses to create a single pose
-    return concatenate_poses(poses)
+        # Anonymize poses
+        if anonymize:
+            poses = anonymize_poses(poses, anonymize)
+
+        # Concatenate the poses to create a single pose
+        return concatenate_poses(poses, config=config, transition_cache=transition_cache)
+
+
+def glosses_to_pose(
+    sentences: list[Gloss],
+    pose_lookup: PoseLookup,
+    spoken_language: str,
+    signed_language: str,
+    source: str = None,
+    anonymize: Union[bool, Pose] = False,
+    config: PipelineConfig = DEFAULT_CONFIG,
+    transition_cache: TransitionCache = None,
+) -> Pose:
+    """Like `gloss_to_pose` for a whole document, in one pass.
+
+    Every distinct segment of all the sentences is looked up, anonymized, reduced and normalized once. All the poses
+    are then concatenated at once, each sentence keeping the start of its first pose and the end of its last pose
+    untrimmed, as `gloss_to_pose` would.
+    """
+    with span("glosses_to_pose", sentences=len(sentences)):
+        segmented = [pose_lookup.segment_sequence(glosses, spoken_language, signed_language) for glosses in sentences]
+        segments = [segment for sentence_segments in segmented for segment in sentence_segments]
+        results = pose_lookup.lookup_segments(segments, spoken_language, signed_language, config)
+
+        found = [segment for segment, pose in results.items() if pose is not None]
+        unique_poses = [results[segment] for segment in found]
+        if anonymize:
+            unique_poses = anonymize_poses(unique_poses, anonymize)
+        with span("prepare", poses=len(unique_poses)):
+            prepared = dict(zip(found, (prepare_pose(pose, config) for pose in unique_poses)))
+
+        poses = []
+        trims = []
+        for glosses, sentence_segments in zip(sentences, segmented):
+            # Every occurrence gets a pose of its own, as concatenation trims the poses
+            sentence_poses = [copy_pose(prepared[segment]) for segment in sentence_segments if segment in prepared]
+            if len(sentence_poses) == 0:
+                gloss_sequence = " ".join([f"{word}/{gloss}" for word, gloss in glosses])
+                raise Exception(f"No poses found for {gloss_sequence}")
+
+            poses.extend(sentence_poses)
+            trims.extend((i > 0, i < len(sentence_poses) - 1) for i in range(len(sentence_poses)))
+
+        return concatenate_poses(poses, trims=trims, config=config, transition_cache=transition_cache)
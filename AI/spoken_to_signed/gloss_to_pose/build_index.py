@@ -0,0 +1,175 @@
+import argparse
+import csv
+import hashlib
+import os
+import struct
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+from pose_format.pose_header import PoseHeader
+from pose_format.utils.reader import BufferReader, ConstStructs
+
+from spoken_to_signed.gloss_to_pose.lookup.csv_lookup import read_index
+from spoken_to_signed.gloss_to_pose.lookup.remote import RemotePoseFetcher, frame_range
+
+# Columns added to every local row, so lookups can read the row's frames directly at these offsets
+INDEX_COLUMNS = [
+    "fps",
+    "frames",
+    "layout",
+    "size",
+    "header_size",
+    "people",
+    "start_frame",
+    "end_frame",
+    "data_offset",
+    "confidence_offset",
+]
+
+HEADER_READ_SIZE = 256 * 1024
+
+
+def read_header(f, size: int) -> tuple[PoseHeader, BufferReader]:
+    buffer = f.read(HEADER_READ_SIZE)
+    try:
+        reader = BufferReader(buffer)
+        return PoseHeader.read(reader), reader
+    except (struct.error, IndexError):
+        if len(buffer) == size:
+            raise
+    # The header is larger than what was read at first
+    buffer += f.read()
+    reader = BufferReader(buffer)
+    return PoseHeader.read(reader), reader
+
+
+def scan_pose_file(pose_path: str) -> dict:
+    """Reads the header of a pose file, and where in the file its frames are stored"""
+    size = os.path.getsize(pose_path)
+    with open(pose_path, "rb") as f:
+        header, reader = read_header(f, size)
+
+    header_size = reader.read_offset
+    version = round(header.version, 3)
+    if version == 0.1:
+        fps, _ = reader.unpack(ConstStructs.double_ushort)
+    elif version == 0.2:
+        fps = reader.unpack(ConstStructs.float)
+        reader.unpack(ConstStructs.uint)
+    else:
+        raise ValueError(f"Unsupported pose format version {header.version}")
+    people = reader.unpack(ConstStructs.ushort)
+
+    points = sum(len(c.points) for c in header.components)
+    dims = header.num_dims()
+    data_offset = reader.read_offset
+    # Like pose_format, the frame count is derived from the file size, the stored count may overflow
+    frames = (size - data_offset) // (people * points * (dims + 1) * 4)
+
+    layout = hashlib.sha1(reader.buffer[:header_size]).hexdigest()[:16]
+
+    return {
+        "fps": fps,
+        "frames": frames,
+        "layout": layout,
+        "size": size,
+        "header_size": header_size,
+        "people": people,
+        "points": points,
+        "dims": dims,
+        "data_offset": data_offset,
+    }
+
+
+def enrich_row(row: dict, info: dict) -> dict:
+    """Adds the frame range and byte offsets of the row's pose, raises a `ValueError` if it is out of bounds.
+
+    Ranges that end after the last frame are clamped to it, like slicing the pose would.
+    """
+    start_frame, end_frame = frame_range(info["fps"], int(row["start"]), int(row["end"]))
+    if end_frame < 0:
+        end_frame += info["frames"]
+    end_frame = min(end_frame, info["frames"])
+    if not 0 <= start_frame < end_frame:
+        raise ValueError(
+            f"Range {row['start']}-{row['end']}ms (frames {start_frame}-{end_frame}) "
+            f"is out of bounds for {info['frames']} frames"
+        )
+
+    frame_points = info["people"] * info["points"]
+    data_size = info["frames"] * frame_points * info["dims"] * 4
+    return {
+        **row,
+        **{column: info[column] for column in ["fps", "frames", "layout", "size", "header_size", "people"]},
+        "start_frame": start_frame,
+        "end_frame": end_frame,
+        "data_offset": info["data_offset"] + start_frame * frame_points * info["dims"] * 4,
+        "confidence_offset": info["data_offset"] + data_size + start_frame * frame_points * 4,
+    }
+
+
+def build_index(directory: str, rows: list[dict] = None, workers: int = None) -> tuple[list[dict], list[str]]:
+    """Validates the rows of a lexicon, adds `INDEX_COLUMNS` to them, and writes them to its `index.csv`.
+
+    Rows that fail validation are kept without these columns, so lookups read them as before, and are
+    returned as errors.
+    """
+    if rows is None:
+        rows = read_index(directory)
+    rows = [{k: v for k, v in row.items() if k not in INDEX_COLUMNS} for row in rows]
+
+    paths = sorted({row["path"] for row in rows if not RemotePoseFetcher.is_remote(row["path"])})
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {path: executor.submit(scan_pose_file, os.path.join(directory, path)) for path in paths}
+
+        files = {}
+        errors = []
+        for path, future in futures.items():
+            try:
+                files[path] = future.result()
+            except FileNotFoundError:
+                errors.append(f"{path}: file does not exist")
+            except (OSError, ValueError, IndexError, struct.error) as e:
+                errors.append(f"{path}: could not read header ({e})")
+
+    indexed_rows = []
+    clamped = 0
+    for row in rows:
+        if row["path"] in files:
+            info = files[row["path"]]
+            try:
+                row = enrich_row(row, info)
+                clamped += frame_range(info["fps"], 0, int(row["end"]))[1] > info["frames"]
+            except ValueError as e:
+                errors.append(f"{row['path']} ({row['words']}/{row['glosses']}): {e}")
+        indexed_rows.append(row)
+    if clamped > 0:
+        print(f"{clamped} entries end after the last frame of their file, they were clamped to it")
+
+    fieldnames = list(rows[0].keys()) + INDEX_COLUMNS
+    with open(os.path.join(directory, "index.csv"), "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=fieldnames, restval="")
+        writer.writeheader()
+        writer.writerows(indexed_rows)
+
+    return indexed_rows, errors
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Validate a lexicon index and add frame counts and offsets")
+    args_parser.add_argument("--directory", type=str, required=True, help="Lexicon directory with an index.csv")
+    args_parser.add_argument("--workers", type=int, default=None)
+    args = args_parser.parse_args()
+
+    rows, errors = build_index(args.directory, workers=args.workers)
+    for error in errors:
+        print(error)
+    print(
+        "Indexed", sum(row.get("layout", "") != "" for row in rows), "of", len(rows), "entries,", len(errors), "errors"
+    )
+    if len(errors) > 0:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
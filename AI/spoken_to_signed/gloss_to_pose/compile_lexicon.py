@@ -0,0 +1,130 @@
+import argparse
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+from pose_format import Pose
+
+from spoken_to_signed.gloss_to_pose.build_index import INDEX_COLUMNS, build_index
+from spoken_to_signed.gloss_to_pose.concatenate import prepare_pose, signing_boundaries
+from spoken_to_signed.gloss_to_pose.config import DEFAULT_CONFIG
+from spoken_to_signed.gloss_to_pose.lookup.csv_lookup import read_index
+from spoken_to_signed.gloss_to_pose.lookup.remote import RemotePoseFetcher, frame_range
+
+
+def compiled_path(row: dict) -> str:
+    # Entries that only use part of a file get a file of their own
+    path = Path(row["path"])
+    if int(row["start"]) == 0 and int(row["end"]) == 0:
+        return str(path)
+    return str(path.with_name(f"{path.stem}.{row['start']}-{row['end']}{path.suffix}"))
+
+
+def end_ms(frames: int, fps: float) -> int:
+    # An end of 0 in the index drops the last frame, so compiled entries spell out their end, as the smallest that
+    # `frame_range` reads every frame up to (a rounded duration can miss the last frame at fractional frame times)
+    end = math.floor(frames * 1000 / fps)
+    while frame_range(fps, 0, end)[1] < frames:
+        end += 1
+    return end
+
+
+def compiled_columns(pose: Pose) -> dict:
+    """The index columns of a compiled entry: where it ends, and the frames it signs in.
+
+    The frames around the signing are kept in the file, so the first and last signs of a sentence keep their lead-in
+    and lead-out like those of other lexicons. Entries where no hand signs span all their frames.
+    """
+    frames = len(pose.body.data)
+    signing = signing_boundaries([pose])[0] or (0, frames)
+    return {"end": end_ms(frames, pose.body.fps), "signing_start": signing[0], "signing_end": signing[1]}
+
+
+def compile_entry(lexicon: str, output: str, row: dict) -> dict:
+    """Stores the entry reduced and normalized, and returns its `compiled_columns`"""
+    source_path = os.path.join(lexicon, row["path"])
+    target_path = os.path.join(output, compiled_path(row))
+
+    # Idempotent, entries are only compiled again when their source changed
+    if os.path.exists(target_path) and os.path.getmtime(target_path) >= os.path.getmtime(source_path):
+        with open(target_path, "rb") as f:
+            return compiled_columns(Pose.read(f.read()))
+
+    with open(source_path, "rb") as f:
+        pose = Pose.read(f.read())
+
+    start_frame, end_frame = frame_range(pose.body.fps, int(row["start"]), int(row["end"]))
+    pose = Pose(pose.header, pose.body[start_frame:end_frame])
+    pose = prepare_pose(pose, DEFAULT_CONFIG)
+
+    os.makedirs(os.path.dirname(target_path), exist_ok=True)
+    temporary_path = f"{target_path}.tmp"
+    with open(temporary_path, "wb") as f:
+        pose.write(f)
+    os.replace(temporary_path, target_path)
+
+    return compiled_columns(pose)
+
+
+def is_compilable(row: dict) -> bool:
+    return not RemotePoseFetcher.is_remote(row["path"]) and row.get("preprocessed") != "1"
+
+
+def compile_lexicon(lexicon: str, output: str, workers: int = None) -> list[dict]:
+    # Offsets of the source files do not apply to the compiled files
+    rows = [{k: v for k, v in row.items() if k not in INDEX_COLUMNS} for row in read_index(lexicon)]
+    local_rows = [row for row in rows if is_compilable(row)]
+
+    # Each distinct file range is compiled once, in parallel
+    entries = {compiled_path(row): row for row in local_rows}
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {path: executor.submit(compile_entry, lexicon, output, row) for path, row in entries.items()}
+        columns = {path: future.result() for path, future in futures.items()}
+
+    compiled_rows = []
+    for row in rows:
+        row = dict(row)
+        if is_compilable(row):
+            # The source is kept, for lookups with a config that does not reduce the poses like the compiled ones
+            path = compiled_path(row)
+            row.update(
+                path=path,
+                start=0,
+                preprocessed="1",
+                reduced="1" if DEFAULT_CONFIG.is_reduce_holistic else "0",
+                source_path=os.path.relpath(os.path.join(lexicon, row["path"]), output),
+                source_start=row["start"],
+                source_end=row["end"],
+                **columns[path],
+            )
+        elif not RemotePoseFetcher.is_remote(row["path"]):
+            # Entries that were already compiled stay where they are, relative to the new index
+            row["path"] = os.path.relpath(os.path.join(lexicon, row["path"]), output)
+            if row.get("source_path"):
+                row["source_path"] = os.path.relpath(os.path.join(lexicon, row["source_path"]), output)
+        row.setdefault("preprocessed", "0")
+        for column in ["reduced", "signing_start", "signing_end", "source_path", "source_start", "source_end"]:
+            row.setdefault(column, "")
+        compiled_rows.append(row)
+
+    os.makedirs(output, exist_ok=True)
+    compiled_rows, errors = build_index(output, compiled_rows, workers)
+    for error in errors:
+        print(error)
+    return compiled_rows
+
+
+def main():
+    args_parser = argparse.ArgumentParser(description="Store lexicon poses already reduced and normalized")
+    args_parser.add_argument("--lexicon", type=str, required=True, help="Directory with an index.csv")
+    args_parser.add_argument("--output", type=str, required=True, help="Directory for the compiled lexicon")
+    args_parser.add_argument("--workers", type=int, default=None)
+    args = args_parser.parse_args()
+
+    rows = compile_lexicon(args.lexicon, args.output, args.workers)
+    print("Compiled", sum(row["preprocessed"] == "1" for row in rows), "of", len(rows), "entries into", args.output)
+
+
+if __name__ == "__main__":
+    main()
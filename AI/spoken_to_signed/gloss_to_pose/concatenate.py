@@ -1,5 +1,6 @@
 import numpy as np
 from pose_format import Pose
+from pose_format.pose_header import PoseHeader, PoseHeaderComponent
 from pose_format.utils.generic import (
     correct_wrists,
     normalize_pose_size,
@@ -7,94 +8,314 @@ from pose_format.utils.generic import (
     reduce_holistic,
 )
 
-from spoken_to_signed.gloss_to_pose.smoothing import smooth_concatenate_poses
+from spoken_to_signed.gloss_to_pose.config import DEFAULT_CONFIG, KEYPOINT_PROFILES, PRECISIONS, PipelineConfig
+from spoken_to_signed.gloss_to_pose.header_layout import get_header_layout
+from spoken_to_signed.gloss_to_pose.smoothing import (
+    find_best_connection_points,
+    smooth_concatenate_poses,
+    transition_frames,
+)
+from spoken_to_signed.gloss_to_pose.tracing import span
+from spoken_to_signed.gloss_to_pose.transition_cache import Transition, TransitionCache
+
+
+class NormalizedPose(Pose):
+    """A pose that already went through `prepare_pose`, so `concatenate_poses` does not reduce or normalize it again.
+
+    Poses of a compiled lexicon also know the frames they sign in (`signing`, as `signing_boundaries` measures them
+    with the default trim settings), so trimming them only cuts. The `entry` identifies the lexicon entry the pose was
+    looked up from, as set by the lookup, so its connections to others can be cached.
+    """
 
+    def __init__(self, header, body, signing=None, entry=None):
+        super().__init__(header, body)
+        self.signing = signing
+        self.entry = entry
 
-class ConcatenationSettings:
-    is_reduce_holistic = True
+
+def copy_pose(pose: Pose) -> Pose:
+    # A pose with its own body, over the same frames, which can be trimmed or normalized without affecting the original
+    if isinstance(pose, NormalizedPose):
+        return NormalizedPose(pose.header, pose.body[:], signing=pose.signing, entry=pose.entry)
+    copy = Pose(pose.header, pose.body[:])
+    copy.entry = getattr(pose, "entry", None)
+    return copy
 
 
 def normalize_pose(pose: Pose) -> Pose:
     return pose.normalize(pose_normalization_info(pose.header))
 
 
-def get_signing_boundary(pose: Pose, wrist_index: int, elbow_index: int) -> tuple[int, int]:
-    # Ideally, this could use a sign language detection model.
+def profile_components(header: PoseHeader, profile: str) -> tuple[list[PoseHeaderComponent], np.ndarray]:
+    # The components of the profile's points, and the indices of these points in `header`
+    layout = get_header_layout(header)
+    profile_points = KEYPOINT_PROFILES[profile]
+
+    components = []
+    indices = []
+    for component in header.components:
+        if component.name not in profile_points:
+            continue
+        start = layout.component_ranges[component.name][0]
+        wanted = profile_points[component.name]
+        kept = [i for i, point in enumerate(component.points) if wanted is None or point in wanted]
+        point_mapping = {old: new for new, old in enumerate(kept)}
+        limbs = [
+            (point_mapping[a], point_mapping[b])
+            for a, b in component.limbs
+            if a in point_mapping and b in point_mapping
+        ]
+        points = [component.points[i] for i in kept]
+        components.append(PoseHeaderComponent(component.name, points, limbs, component.colors, component.format))
+        indices.extend(start + i for i in kept)
+    return components, np.array(indices, dtype=np.int64)
+
+
+def apply_keypoint_profile(pose: Pose, profile: str) -> Pose:
+    """The pose with only the points of the keypoint `profile` (see `KEYPOINT_PROFILES`), in header order"""
+    if KEYPOINT_PROFILES[profile] is None:
+        return pose
+    layout = get_header_layout(pose.header)
+    components, indices = layout.cached(("keypoint_profile", profile), lambda: profile_components(pose.header, profile))
+    if len(indices) == layout.total_points:
+        return pose
+
+    header = PoseHeader(pose.header.version, pose.header.dimensions, components, pose.header.is_bbox)
+    body = pose.body.get_points(indices)
+    if isinstance(pose, NormalizedPose):
+        return NormalizedPose(header, body, signing=pose.signing, entry=pose.entry)
+    return Pose(header, body)
+
+
+def prepare_pose(pose: Pose, config: PipelineConfig = DEFAULT_CONFIG) -> NormalizedPose:
+    if isinstance(pose, NormalizedPose):
+        return apply_keypoint_profile(pose, config.keypoint_profile)
+
+    entry = getattr(pose, "entry", None)
+    if config.is_reduce_holistic:
+        pose = reduce_holistic(pose)
+    pose = apply_keypoint_profile(pose, config.keypoint_profile)
+    pose = normalize_pose(pose)
+    return NormalizedPose(pose.header, pose.body, entry=entry)
+
+
+# Frames kept around the signing, before its first and after its last active frame
+TRIM_MARGIN = 5
 
-    pose_length = len(pose.body.data)
 
-    wrist_exists = pose.body.confidence[:, 0, wrist_index] > 0
-    first_non_zero_index = np.argmax(wrist_exists).tolist()
-    last_non_zero_index = pose_length - np.argmax(wrist_exists[::-1])
+def trim_keypoint_indices(header) -> np.ndarray:
+    # Indices of the left and right wrists, elbows and shoulders
+    layout = get_header_layout(header)
+    points = [f"{hand}_{part}" for part in ["WRIST", "ELBOW", "SHOULDER"] for hand in ["LEFT", "RIGHT"]]
+    return layout.cached("trim_keypoints", lambda: layout.keypoint_indices("POSE_LANDMARKS", points))
 
-    wrist_y = pose.body.data[:, 0, wrist_index, 1]
-    elbow_y = pose.body.data[:, 0, elbow_index, 1]
 
-    wrist_above_elbow = wrist_y < elbow_y
-    if not np.any(wrist_above_elbow):
-        return None, None
-    first_active_frame = np.argmax(wrist_above_elbow).tolist()
-    last_active_frame = pose_length - np.argmax(wrist_above_elbow[::-1])
+def hand_activity(
+    keypoints: np.ma.MaskedArray, lengths: np.ndarray, fps: np.ndarray, activity: str, velocity: float = 0.5
+) -> np.ndarray:
+    """Whether each hand (left, right) is signing in every frame of poses of `lengths`, one after the other.
 
-    return (max(first_non_zero_index, first_active_frame - 5), min(last_non_zero_index, last_active_frame + 5))
+    The "position" activity is the wrist above the elbow. The "velocity" activity is the wrist moving faster than
+    `velocity` shoulder widths per second.
+    """
+    missing = np.ma.getmaskarray(keypoints).any(axis=-1)
+    points = np.ma.getdata(keypoints)
+    wrists, elbows, shoulders = points[:, 0:2], points[:, 2:4], points[:, 4:6]
 
+    if activity == "position":
+        return (wrists[..., 1] < elbows[..., 1]) & ~missing[:, 0:2] & ~missing[:, 2:4]
+    if activity != "velocity":
+        raise ValueError(f"Unknown trim activity {activity}, expected position or velocity")
 
-def trim_pose(pose, start=True, end=True):
-    if len(pose.body.data) == 0:
+    # The mean shoulder width of each pose, so speeds compare between poses of any scale
+    offsets = np.cumsum([0, *lengths[:-1]])
+    shoulder_widths = np.sqrt(((shoulders[:, 0] - shoulders[:, 1]) ** 2).sum(axis=-1))
+    shoulders_present = ~missing[:, 4:6].any(axis=-1)
+    counts = np.add.reduceat(shoulders_present, offsets)
+    sums = np.add.reduceat(np.where(shoulders_present, shoulder_widths, 0), offsets)
+    scales = np.repeat(np.where(counts > 0, sums / np.maximum(counts, 1), 1), lengths)
+
+    # Speed from the previous frame, or to the next frame for the first frame of each pose
+    displacement = np.zeros(wrists.shape[:2])
+    displacement[1:] = np.sqrt(((wrists[1:] - wrists[:-1]) ** 2).sum(axis=-1))
+    moved = ~missing[:, 0:2]
+    moved[1:] &= ~missing[:-1, 0:2]
+    single = (lengths == 1)[:, None]
+    next_frames = np.minimum(offsets + 1, len(wrists) - 1)
+    displacement[offsets] = np.where(single, 0, displacement[next_frames])
+    moved[offsets] = moved[next_frames] & ~single
+
+    speed = displacement * np.repeat(fps, lengths)[:, None] / scales[:, None]
+    return moved & (speed > velocity)
+
+
+def signing_boundaries(poses: list[Pose], config: PipelineConfig = DEFAULT_CONFIG) -> list[tuple[int, int]]:
+    """The frames where signing starts and ends in every pose, or None for poses where no hand is active.
+
+    Both hands of all the poses are measured at once. The signing extends from the first to the last active frame
+    of any hand, with a margin of `TRIM_MARGIN` frames, within the frames where that hand's wrist exists.
+    """
+    indices = [trim_keypoint_indices(pose.header) for pose in poses]
+    keypoints = np.ma.concatenate([pose.body.data[:, 0, i] for pose, i in zip(poses, indices)])
+    wrist_exists = np.concatenate([pose.body.confidence[:, 0, i[:2]] for pose, i in zip(poses, indices)]) > 0
+
+    lengths = np.array([len(pose.body.data) for pose in poses])
+    offsets = np.cumsum([0, *lengths[:-1]])
+    frames = (np.arange(lengths.sum()) - np.repeat(offsets, lengths))[:, None]
+    fps = np.array([pose.body.fps for pose in poses])
+    active = hand_activity(keypoints, lengths, fps, config.trim_activity, config.trim_velocity)
+
+    never = np.iinfo(np.int64).max
+    first_existing = np.minimum.reduceat(np.where(wrist_exists, frames, never), offsets)
+    first_existing[first_existing == never] = 0
+    last_existing = np.maximum.reduceat(np.where(wrist_exists, frames + 1, -1), offsets)
+    last_existing = np.where(last_existing < 0, lengths[:, None], last_existing)
+    first_active = np.minimum.reduceat(np.where(active, frames, never), offsets)
+    last_active = np.maximum.reduceat(np.where(active, frames + 1, -1), offsets)
+
+    starts = np.maximum(first_existing, first_active - TRIM_MARGIN)
+    ends = np.minimum(last_existing, last_active + TRIM_MARGIN)
+    signing = first_active != never
+    boundaries = []
+    for pose_signing, pose_starts, pose_ends in zip(signing, starts, ends):
+        if not pose_signing.any():
+            boundaries.append(None)
+        else:
+            boundaries.append((int(pose_starts[pose_signing].min()), int(pose_ends[pose_signing].max())))
+    return boundaries
+
+
+def trim_poses(
+    poses: list[Pose], trims: list[tuple[bool, bool]] = None, config: PipelineConfig = DEFAULT_CONFIG
+) -> list[Pose]:
+    """Trims every pose to where it signs, `trims` holds whether to trim the start and the end of each pose"""
+    if any(len(pose.body.data) == 0 for pose in poses):
         raise ValueError("Cannot trim an empty pose")
+    if len(poses) == 0:
+        return poses
+    if trims is None:
+        trims = [(True, True)] * len(poses)
 
-    first_frames = []
-    last_frames = []
+    # Boundaries known beforehand were measured with the default trim settings, the others are measured at once
+    boundaries = [None] * len(poses)
+    if (config.trim_activity, config.trim_velocity) == (DEFAULT_CONFIG.trim_activity, DEFAULT_CONFIG.trim_velocity):
+        boundaries = [getattr(pose, "signing", None) for pose in poses]
+    unknown = [i for i, boundary in enumerate(boundaries) if boundary is None]
+    if len(unknown) > 0:
+        for i, boundary in zip(unknown, signing_boundaries([poses[i] for i in unknown], config)):
+            boundaries[i] = boundary
 
-    hands = ["LEFT", "RIGHT"]
-    for hand in hands:
-        wrist_index = pose.header._get_point_index("POSE_LANDMARKS", f"{hand}_WRIST")
-        elbow_index = pose.header._get_point_index("POSE_LANDMARKS", f"{hand}_ELBOW")
-        boundary_start, boundary_end = get_signing_boundary(pose, wrist_index, elbow_index)
-        if boundary_start is not None:
-            first_frames.append(boundary_start)
-        if boundary_end is not None:
-            last_frames.append(boundary_end)
+    for pose, boundary, (start, end) in zip(poses, boundaries, trims):
+        if boundary is None:
+            continue
+        first_frame = boundary[0] if start else 0
+        last_frame = boundary[1] if end else len(pose.body.data)
+        pose.body.data = pose.body.data[first_frame:last_frame]
+        pose.body.confidence = pose.body.confidence[first_frame:last_frame]
+        if getattr(pose, "signing", None) is not None:
+            pose.signing = (boundary[0] - first_frame, boundary[1] - first_frame)
+    return poses
 
-    if len(first_frames) == 0:
-        return pose
 
-    first_frame = min(first_frames)
-    last_frame = max(last_frames)
+def trim_pose(pose, start=True, end=True, config: PipelineConfig = DEFAULT_CONFIG):
+    return trim_poses([pose], [(start, end)], config)[0]
 
-    if not start:
-        first_frame = 0
-    if not end:
-        last_frame = len(pose.body.data)
 
-    pose.body.data = pose.body.data[first_frame:last_frame]
-    pose.body.confidence = pose.body.confidence[first_frame:last_frame]
-    return pose
+def caches_transition_frames(config: PipelineConfig) -> bool:
+    # Cubic easing reads the frames around each transition, so its frames depend on more than the two entries
+    return config.interpolation == "gaps" and config.easing != "cubic"
 
 
-def concatenate_poses(poses: list[Pose], trim=True) -> Pose:
-    if ConcatenationSettings.is_reduce_holistic:
-        print("Reducing poses...")
-        poses = [reduce_holistic(p) for p in poses]
+def find_transitions(
+    poses: list[NormalizedPose],
+    trims: list[tuple[bool, bool]],
+    config: PipelineConfig = DEFAULT_CONFIG,
+    cache: TransitionCache = None,
+) -> list[Transition]:
+    """Transitions of every adjacent pair, the connection points of all the pairs are searched for at once.
 
-    print("Normalizing poses...")
-    poses = [normalize_pose(p) for p in poses]
+    When both poses are lexicon entries, the transition is kept in the `cache` (anything with `get` and `set`), by
+    entries, how they were trimmed (`trims` holds whether the start and the end of each pose were trimmed) and the
+    `config` they were prepared with. Its padding frames are only synthesized when "gaps" interpolation can copy them.
+    """
+    keys = [None] * (len(poses) - 1)
+    transitions = [None] * (len(poses) - 1)
+    missing = []
+    for i, (pose1, pose2) in enumerate(zip(poses, poses[1:])):
+        if cache is not None and pose1.entry is not None and pose2.entry is not None:
+            keys[i] = (pose1.entry, trims[i], pose2.entry, trims[i + 1], config)
+            transitions[i] = cache.get(keys[i])
+        if transitions[i] is None:
+            missing.append(i)
+
+    found = find_best_connection_points(
+        [(poses[i], poses[i + 1]) for i in missing],
+        window=config.connection_window,
+        keypoints=config.connection_keypoints,
+        confidence_weighted=config.connection_confidence_weighted,
+    )
+    padding_frames = int(config.padding * poses[0].body.fps)
+    compute_dtype, _ = PRECISIONS[config.precision]
+    for i, connection_point in zip(missing, found):
+        transition = Transition(connection_point)
+        if caches_transition_frames(config):
+            end, start = connection_point
+            frames = transition_frames(
+                poses[i], end - 1, poses[i + 1], start, padding_frames, config.easing, compute_dtype
+            )
+            transition = Transition(connection_point, *frames)
+        transitions[i] = transition
+        if keys[i] is not None:
+            cache.set(keys[i], transition)
+    return transitions
+
+
+def concatenate_poses(
+    poses: list[Pose],
+    trim=True,
+    connection_points: list[tuple[int, int]] = None,
+    trims: list[tuple[bool, bool]] = None,
+    config: PipelineConfig = DEFAULT_CONFIG,
+    transition_cache: TransitionCache = None,
+) -> Pose:
+    # trims, if given, hold whether to trim the start and the end of each pose, by default all but the sequence ends
+    # transition_cache, if given, keeps the transitions between lexicon entries across calls (see `find_transitions`)
+    with span("prepare", poses=len(poses)):
+        poses = [prepare_pose(p, config) for p in poses]
 
     # Trim the poses to only include the parts where the hands are visible
     if trim:
-        print("Trimming poses...")
-        poses = [trim_pose(p, i > 0, i < len(poses) - 1) for i, p in enumerate(poses)]
+        if trims is None:
+            trims = [(i > 0, i < len(poses) - 1) for i in range(len(poses))]
+        with span("trim", poses=len(poses)):
+            trim_poses(poses, trims, config)
+    else:
+        trims = [(False, False)] * len(poses)
+
+    transitions = None
+    if connection_points is None and len(poses) > 1:
+        with span("find_transitions", pairs=len(poses) - 1):
+            transitions = find_transitions(poses, trims, config, transition_cache)
+        connection_points = [transition.connection_point for transition in transitions]
+        if caches_transition_frames(config):
+            transitions = [None if t.data is None else (t.data, t.confidence) for t in transitions]
+        else:
+            transitions = None
 
     # Concatenate all poses
-    print("Smooth concatenating poses...")
-    pose = smooth_concatenate_poses(poses)
+    with span("smooth_concatenate", poses=len(poses)):
+        pose = smooth_concatenate_poses(poses, config, connection_points=connection_points, transitions=transitions)
 
     # Correct the wrists (should be after smoothing)
-    print("Correcting wrists...")
-    pose = correct_wrists(pose)
+    with span("correct_wrists"):
+        pose = correct_wrists(pose)
 
     # Scale the newly created pose
-    print("Scaling pose...")
-    normalize_pose_size(pose)
+    with span("scale"):
+        normalize_pose_size(pose)
 
+    _, storage_dtype = PRECISIONS[config.precision]
+    if pose.body.data.dtype.itemsize > np.dtype(storage_dtype).itemsize:
+        pose.body.data = pose.body.data.astype(storage_dtype)
+        pose.body.confidence = pose.body.confidence.astype(storage_dtype)
     return pose
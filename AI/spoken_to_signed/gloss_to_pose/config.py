@@ -0,0 +1,88 @@
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+# Keypoints compared to connect two poses, by component, None for all the points of a component
+CONNECTION_KEYPOINTS = {
+    "POSE_LANDMARKS": ["LEFT_WRIST", "RIGHT_WRIST", "LEFT_ELBOW", "RIGHT_ELBOW"],
+    "LEFT_HAND_LANDMARKS": None,
+    "RIGHT_HAND_LANDMARKS": None,
+}
+
+# Components smoothed with their own (window_length, polyorder), or not smoothed at all for None. With these default
+# settings, the last face point is smoothed like the body, as it always was.
+SAVGOL_COMPONENTS = {"FACE_LANDMARKS": None}
+
+# Face mesh points outlining the face and the outer lips
+FACE_CONTOUR_POINTS = [
+    str(p)
+    for p in [10, 338, 297, 332, 284, 251, 389, 356, 454, 323, 361, 288, 397, 365, 379, 378, 400, 377, 152, 148, 176]
+    + [149, 150, 136, 172, 58, 132, 93, 234, 127, 162, 21, 54, 103, 67, 109]
+    + [61, 146, 91, 181, 84, 17, 314, 405, 321, 375, 291, 409, 270, 269, 267, 0, 37, 39, 40, 185]
+]
+
+# Points of each component a profile keeps (None for all of them), or None to keep every component. Profiles keep
+# the shoulders, elbows and wrists, which normalization, trimming and connecting poses rely on.
+KEYPOINT_PROFILES = {
+    "full": None,
+    "hands_upper_body": {
+        "POSE_LANDMARKS": ["LEFT_SHOULDER", "RIGHT_SHOULDER", "LEFT_ELBOW", "RIGHT_ELBOW", "LEFT_WRIST", "RIGHT_WRIST"],
+        "LEFT_HAND_LANDMARKS": None,
+        "RIGHT_HAND_LANDMARKS": None,
+    },
+    "hands_body_face_contour": {
+        "POSE_LANDMARKS": None,
+        "FACE_LANDMARKS": FACE_CONTOUR_POINTS,
+        "LEFT_HAND_LANDMARKS": None,
+        "RIGHT_HAND_LANDMARKS": None,
+    },
+}
+
+# The dtype of each precision to compute in, and to store the result in
+PRECISIONS = {
+    "float64": (np.float64, np.float64),
+    "float32": (np.float32, np.float32),
+    "float16": (np.float32, np.float16),
+}
+
+
+def freeze_points(points: Optional[dict]) -> Optional[tuple]:
+    # A dict of component names to points (or None) as (name, points) pairs, which unlike the dict can be hashed
+    if points is None:
+        return None
+    return tuple((name, tuple(value) if value is not None else None) for name, value in points.items())
+
+
+class PipelineConfig(NamedTuple):
+    """How glosses are turned into a pose, passed along with every call rather than set globally.
+
+    The configuration is immutable and hashable, so concurrent jobs can each run with their own, and results computed
+    with it can be cached by it. Fields of points by component hold `freeze_points` pairs rather than a dict.
+    """
+
+    is_reduce_holistic: bool = True
+    # Points of `KEYPOINT_PROFILES` kept right after lookup
+    keypoint_profile: str = "full"
+    # Frames are trimmed to where the wrist is above the elbow ("position"), or where it moves ("velocity") faster than
+    # `trim_velocity` shoulder widths per second
+    trim_activity: str = "position"
+    trim_velocity: float = 0.5
+    # Seconds of transition between two poses
+    padding: float = 0.20
+    # "linear" re-fits every frame like `NumPyPoseBody.interpolate`, "gaps" only fills the transitions with `easing`
+    interpolation: str = "linear"
+    easing: str = "linear"
+    # Seconds (or fraction of a pose, if smaller) searched for where two poses connect, comparing the keypoints
+    # weighted by their confidence or not
+    connection_window: float = 0.3
+    connection_keypoints: Optional[tuple] = freeze_points(CONNECTION_KEYPOINTS)
+    connection_confidence_weighted: bool = True
+    # Savitzky-Golay filter of the concatenated pose, with components smoothed with other settings
+    smoothing_window: int = 3
+    smoothing_polyorder: int = 1
+    smoothing_components: tuple = freeze_points(SAVGOL_COMPONENTS)
+    # Poses are concatenated and smoothed in "float64", "float32", or "float32" then stored in "float16"
+    precision: str = "float64"
+
+
+DEFAULT_CONFIG = PipelineConfig()
@@ -0,0 +1,124 @@
+import threading
+import weakref
+from collections.abc import Iterable
+from typing import Callable, Optional
+
+import numpy as np
+from pose_format.pose_header import PoseHeader
+
+
+def header_fingerprint(header: PoseHeader) -> tuple:
+    # Everything point indices and edges are resolved from, headers with the same fingerprint share a layout
+    return tuple(
+        (component.name, tuple(component.points), tuple(tuple(limb) for limb in component.limbs))
+        for component in header.components
+    )
+
+
+class HeaderLayout:
+    """The point indices of a pose header, resolved once and shared by every header with the same fingerprint.
+
+    Besides named keypoints and component ranges, the layout memoizes anything derived from the indices (see
+    `cached`), so the hot paths resolve them once per layout rather than per pose, frame or request.
+    """
+
+    def __init__(self, header: PoseHeader):
+        self.fingerprint = header_fingerprint(header)
+        self.total_points = header.total_points()
+
+        self.point_indices = {}
+        self.component_ranges = {}
+        # The first point of each lowercased name, across components
+        self.lowered_points = {}
+        start = 0
+        for component in header.components:
+            for i, point in enumerate(component.points):
+                self.point_indices.setdefault((component.name, point), start + i)
+                self.lowered_points.setdefault(point.lower(), start + i)
+            self.component_ranges[component.name] = (start, start + len(component.points))
+            start += len(component.points)
+
+        edges = []
+        self.edge_components = []
+        self.edge_colors = []
+        for component in header.components:
+            for i, limb in enumerate(component.limbs):
+                edges.append(self.resolve_limb(component, limb))
+                self.edge_components.append(component.name)
+                color = tuple(int(c) for c in component.colors[i]) if i < len(component.colors) else None
+                self.edge_colors.append(color)
+        self.edges = np.array(edges, dtype=np.int64).reshape(-1, 2)
+
+        self.derived = {}
+        # Reentrant, so values can be derived from other cached values
+        self.derived_lock = threading.RLock()
+
+    def point_index(self, component: str, point: str) -> int:
+        try:
+            return self.point_indices[(component, point)]
+        except KeyError:
+            raise ValueError(f"Couldn't find point {point} in component {component}") from None
+
+    def keypoint_indices(self, component: str, points: Iterable[str]) -> np.ndarray:
+        return np.array([self.point_index(component, point) for point in points], dtype=np.int64)
+
+    def component_mask(self, components: Iterable[str]) -> np.ndarray:
+        """Which points belong to any of the `components`, like `face_mask` for the face"""
+        mask = np.zeros(self.total_points, dtype=bool)
+        for component in components:
+            if component in self.component_ranges:
+                start, end = self.component_ranges[component]
+                mask[start:end] = True
+        return mask
+
+    @property
+    def face_mask(self) -> np.ndarray:
+        return self.cached("face_mask", lambda: self.component_mask(["FACE_LANDMARKS"]))
+
+    def find_point(self, names: Iterable[str]) -> Optional[int]:
+        # The first point, in header order, with any of the names (case insensitive)
+        indices = [self.lowered_points[name.lower()] for name in names if name.lower() in self.lowered_points]
+        return min(indices) if len(indices) > 0 else None
+
+    def resolve_limb(self, component, limb) -> tuple[int, int]:
+        # A limb holds point names, indices into the component points, or global indices if they are larger
+        a, b = limb
+        if isinstance(a, str) or isinstance(b, str):
+            return self.point_index(component.name, a), self.point_index(component.name, b)
+        if max(a, b) < len(component.points):
+            return (
+                self.point_index(component.name, component.points[a]),
+                self.point_index(component.name, component.points[b]),
+            )
+        return int(a), int(b)
+
+    def cached(self, key, factory: Callable):
+        """Memoizes `factory()` under `key`, for values derived from this layout"""
+        value = self.derived.get(key)
+        if value is None:
+            with self.derived_lock:
+                value = self.derived.get(key)
+                if value is None:
+                    value = factory()
+                    self.derived[key] = value
+        return value
+
+
+_LAYOUTS = {}
+_HEADER_LAYOUTS = weakref.WeakKeyDictionary()
+_LAYOUTS_LOCK = threading.Lock()
+
+
+def get_header_layout(header: PoseHeader) -> HeaderLayout:
+    # Headers already seen are found by identity, others by fingerprint, so equal headers share one layout
+    layout = _HEADER_LAYOUTS.get(header)
+    if layout is not None:
+        return layout
+
+    fingerprint = header_fingerprint(header)
+    with _LAYOUTS_LOCK:
+        layout = _LAYOUTS.get(fingerprint)
+        if layout is None:
+            layout = _LAYOUTS[fingerprint] = HeaderLayout(header)
+        _HEADER_LAYOUTS[header] = layout
+    return layout
@@ -1,15 +1,26 @@
 import csv
 import os
 
+from .executor import LookupExecutor
 from .lookup import PoseLookup
+from .remote import RemotePoseFetcher
 
 
-class CSVPoseLookup(PoseLookup):
-    def __init__(self, directory: str, backup: PoseLookup = None):
-        if not os.path.exists(directory):
-            raise ValueError(f"Directory {directory} does not exist")
+def read_index(directory: str) -> list[dict]:
+    if not os.path.exists(directory):
+        raise ValueError(f"Directory {directory} does not exist")
+
+    with open(os.path.join(directory, "index.csv"), encoding="utf-8") as f:
+        return list(csv.DictReader(f))
 
-        with open(os.path.join(directory, "index.csv"), encoding="utf-8") as f:
-            rows = list(csv.DictReader(f))
 
-        super().__init__(rows=rows, directory=directory, backup=backup)
+class CSVPoseLookup(PoseLookup):
+    def __init__(
+        self,
+        directory: str,
+        backup: PoseLookup = None,
+        fetcher: RemotePoseFetcher = None,
+        executor: LookupExecutor = None,
+    ):
+        rows = read_index(directory)
+        super().__init__(rows=rows, directory=directory, backup=backup, fetcher=fetcher, executor=executor)
@@ -0,0 +1,87 @@
+import os
+import threading
+import time
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable
+
+
+class LookupExecutor:
+    """A long-lived thread pool shared by lexicon lookups, instead of a new pool per call.
+
+    Each call to `map` has at most `per_call` items in flight, so one long request can not take every worker from
+    concurrent ones. Time spent waiting for a worker and time spent loading are measured separately. Functions run
+    on the pool must not call `map` themselves, as they could wait on workers that wait on them.
+    """
+
+    def __init__(self, max_workers: int = None, per_call: int = None):
+        self.max_workers = max_workers if max_workers is not None else min(32, (os.cpu_count() or 1) + 4)
+        self.per_call = per_call if per_call is not None else self.max_workers
+        self.executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="lookup")
+
+        self.lock = threading.Lock()
+        self.tasks = 0
+        self.running = 0
+        self.wait_seconds = 0.0
+        self.load_seconds = 0.0
+        self.max_wait_seconds = 0.0
+
+    def record(self, wait: float, load: float):
+        with self.lock:
+            self.tasks += 1
+            self.wait_seconds += wait
+            self.load_seconds += load
+            self.max_wait_seconds = max(self.max_wait_seconds, wait)
+
+    def map(self, function: Callable, items: Iterable) -> list:
+        slots = threading.BoundedSemaphore(self.per_call)
+
+        def run(item, queued: float):
+            started = time.perf_counter()
+            with self.lock:
+                self.running += 1
+            try:
+                return function(item)
+            finally:
+                finished = time.perf_counter()
+                with self.lock:
+                    self.running -= 1
+                self.record(started - queued, finished - started)
+                slots.release()
+
+        futures = []
+        for item in items:
+            queued = time.perf_counter()
+            slots.acquire()
+            futures.append(self.executor.submit(run, item, queued))
+        return [future.result() for future in futures]
+
+    def stats(self) -> dict:
+        with self.lock:
+            tasks = max(self.tasks, 1)
+            return {
+                "max_workers": self.max_workers,
+                "per_call": self.per_call,
+                "running": self.running,
+                "tasks": self.tasks,
+                "mean_wait_ms": round(self.wait_seconds / tasks * 1000, 3),
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+                "mean_load_ms": round(self.load_seconds / tasks * 1000, 3),
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
+
+
+_SHARED_EXECUTOR = None
+_SHARED_EXECUTOR_LOCK = threading.Lock()
+
+
+def shared_executor() -> LookupExecutor:
+    # The executor of lookups that were not given one, created on first use
+    global _SHARED_EXECUTOR
+    if _SHARED_EXECUTOR is None:
+        with _SHARED_EXECUTOR_LOCK:
+            if _SHARED_EXECUTOR is None:
+                _SHARED_EXECUTOR = LookupExecutor()
+    return _SHARED_EXECUTOR
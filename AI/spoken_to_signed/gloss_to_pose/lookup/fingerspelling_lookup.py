@@ -1,8 +1,13 @@
+import threading
 from pathlib import Path
 
 from pose_format import Pose
 
 from .. import CSVPoseLookup, concatenate_poses
+from ..concatenate import NormalizedPose, normalize_pose, prepare_pose, trim_pose
+from ..config import DEFAULT_CONFIG, PipelineConfig
+from ..lru_cache import LRUCache
+from ..smoothing import find_best_connection_point
 
 
 class FingerspellingPoseLookup(CSVPoseLookup):
@@ -11,31 +16,153 @@ class FingerspellingPoseLookup(CSVPoseLookup):
 
         super().__init__(directory=str(fs_directory))
 
-        self.alphabets = {
+        # Character trie of every alphabet, to decompose words with a greedy longest match
+        self.alphabet_tries = {
             spoken_language: {
-                signed_language: sorted(si_values.keys(), key=len, reverse=True)
+                signed_language: self.make_alphabet_trie(si_values.keys())
                 for signed_language, si_values in sp_values.items()
             }
             for spoken_language, sp_values in self.words_index.items()
         }
 
-    def characters_lookup(self, word: str, spoken_language: str, signed_language: str):
-        if word != "":
-            rows = self.words_index[spoken_language][signed_language]
-            alphabet = self.alphabets[spoken_language][signed_language]
-            found = False
-            for key in alphabet:
-                if key in word:
-                    found = True
-                    match_index = word.index(key)
-
-                    yield from self.characters_lookup(word[:match_index], spoken_language, signed_language)
-                    yield self.get_pose(rows[key][0])
-                    yield from self.characters_lookup(word[match_index + len(key) :], spoken_language, signed_language)
+        self.decompositions = LRUCache(maxsize=1000)
+
+        # Letters are prepared, trimmed and connected once per config, so spelling a word only cuts and concatenates
+        # them
+        self.letter_poses = LRUCache(maxsize=1000)
+        self.letter_segments = LRUCache(maxsize=4000)
+        self.transitions = LRUCache(maxsize=10000)
+        self.letter_poses_lock = threading.RLock()
+
+        self.words_cache = LRUCache(maxsize=200)
+
+    def make_alphabet_trie(self, keys) -> dict:
+        trie = {}
+        for key in keys:
+            node = trie
+            for character in key:
+                node = node.setdefault(character, {})
+            node[None] = key
+        return trie
+
+    def tokenize(self, word: str, spoken_language: str, signed_language: str) -> tuple[str, ...]:
+        cache_key = (word, spoken_language, signed_language)
+        keys = self.decompositions.get(cache_key)
+        if keys is not None:
+            return keys
+
+        trie = self.alphabet_tries[spoken_language][signed_language]
+        keys = []
+        i = 0
+        while i < len(word):
+            node = trie
+            match = None
+            for character in word[i:]:
+                node = node.get(character)
+                if node is None:
                     break
+                match = node.get(None, match)
+
+            if match is None:
+                raise FileNotFoundError(f"Characters {word[i:]} not found in fingerspelling lexicon")
+
+            keys.append(match)
+            i += len(match)
+
+        keys = tuple(keys)
+        self.decompositions.set(cache_key, keys)
+        return keys
 
-            if not found:
-                raise FileNotFoundError(f"Characters {word} not found in fingerspelling lexicon")
+    def get_letter_pose(
+        self,
+        key: str,
+        spoken_language: str,
+        signed_language: str,
+        stretched=False,
+        config: PipelineConfig = DEFAULT_CONFIG,
+    ) -> NormalizedPose:
+        # Letter poses are prepared once, the stretched variant (only used to end a word) is expensive so made on demand
+        cache_key = (key, spoken_language, signed_language, stretched, config)
+        pose = self.letter_poses.get(cache_key)
+        if pose is None:
+            with self.letter_poses_lock:
+                pose = self.letter_poses.get(cache_key)
+                if pose is None:
+                    pose = self.get_pose(self.words_index[spoken_language][signed_language][key][0])
+                    if stretched:
+                        pose = self.stretch_pose(pose, 2)
+                    pose = prepare_pose(pose, config)
+                    self.letter_poses.set(cache_key, pose)
+        return pose
+
+    def get_letter_segment(
+        self,
+        key: str,
+        spoken_language: str,
+        signed_language: str,
+        first: bool,
+        last: bool,
+        config: PipelineConfig = DEFAULT_CONFIG,
+    ):
+        # The letter as concatenate_poses trims it, given its position in the word. The last letter is stretched.
+        cache_key = (key, spoken_language, signed_language, first, last, config)
+        pose = self.letter_segments.get(cache_key)
+        if pose is None:
+            with self.letter_poses_lock:
+                pose = self.letter_segments.get(cache_key)
+                if pose is None:
+                    pose = self.get_letter_pose(key, spoken_language, signed_language, stretched=last, config=config)
+                    pose = NormalizedPose(pose.header, pose.body[:])
+                    if not (first and last):
+                        pose = trim_pose(pose, start=not first, end=not last, config=config)
+                    self.letter_segments.set(cache_key, pose)
+        return pose
+
+    def get_transition(
+        self,
+        key1: str,
+        key2: str,
+        spoken_language: str,
+        signed_language: str,
+        first: bool,
+        last: bool,
+        config: PipelineConfig = DEFAULT_CONFIG,
+    ):
+        # Connection point between two consecutive letters, `first` and `last` refer to key1 and key2 respectively
+        cache_key = (key1, key2, spoken_language, signed_language, first, last, config)
+        transition = self.transitions.get(cache_key)
+        if transition is None:
+            pose1 = self.get_letter_segment(key1, spoken_language, signed_language, first, False, config)
+            pose2 = self.get_letter_segment(key2, spoken_language, signed_language, False, last, config)
+            transition = find_best_connection_point(
+                pose1,
+                pose2,
+                window=config.connection_window,
+                keypoints=config.connection_keypoints,
+                confidence_weighted=config.connection_confidence_weighted,
+            )
+            self.transitions.set(cache_key, transition)
+        return transition
+
+    def characters_lookup(
+        self, word: str, spoken_language: str, signed_language: str, config: PipelineConfig = DEFAULT_CONFIG
+    ):
+        keys = self.tokenize(word, spoken_language, signed_language)
+        for i, key in enumerate(keys):
+            pose = self.get_letter_segment(key, spoken_language, signed_language, i == 0, i == len(keys) - 1, config)
+            # Concatenation reassigns the body arrays, so the shared letter pose gets a fresh body
+            yield NormalizedPose(pose.header, pose.body[:])
+
+    def spell(
+        self, word: str, spoken_language: str, signed_language: str, config: PipelineConfig = DEFAULT_CONFIG
+    ) -> Pose:
+        keys = self.tokenize(word, spoken_language, signed_language)
+        poses = list(self.characters_lookup(word, spoken_language, signed_language, config))
+        connection_points = [
+            self.get_transition(key1, key2, spoken_language, signed_language, i == 0, i == len(keys) - 2, config)
+            for i, (key1, key2) in enumerate(zip(keys, keys[1:]))
+        ]
+        return concatenate_poses(poses, trim=False, connection_points=connection_points, config=config)
 
     def stretch_pose(self, pose: Pose, by: float) -> Pose:
         fps = pose.body.fps
@@ -43,14 +170,28 @@ class FingerspellingPoseLookup(CSVPoseLookup):
         pose.body.fps = fps
         return pose
 
-    def lookup(self, word: str, gloss: str, spoken_language: str, signed_language: str, source: str = None) -> Pose:
+    def lookup(
+        self,
+        word: str,
+        gloss: str,
+        spoken_language: str,
+        signed_language: str,
+        source: str = None,
+        config: PipelineConfig = DEFAULT_CONFIG,
+    ) -> NormalizedPose:
         if spoken_language not in self.words_index or signed_language not in self.words_index[spoken_language]:
             raise FileNotFoundError(
                 f"Language pair {spoken_language} -> {signed_language} not supported for fingerspelling"
             )
 
-        poses = list(self.characters_lookup(word.lower(), spoken_language, signed_language))
-
-        poses[-1] = self.stretch_pose(poses[-1], 2)
+        word = word.lower()
+        # The letters are already reduced and profiled with `config`, so the spelled word is only normalized, and is
+        # returned as prepared like a compiled lexicon entry
+        cache_key = (word, spoken_language, signed_language, config)
+        pose = self.words_cache.get(cache_key)
+        if pose is None:
+            pose = normalize_pose(self.spell(word, spoken_language, signed_language, config))
+            self.words_cache.set(cache_key, pose)
 
-        return concatenate_poses(poses)
+        entry = ("fingerspelling", word, spoken_language, signed_language)
+        return NormalizedPose(pose.header, pose.body[:], entry=entry)
@@ -0,0 +1,111 @@
+import os
+import threading
+from typing import Callable
+
+from .csv_lookup import read_index
+from .executor import LookupExecutor
+from .lookup import PoseLookup
+from .remote import RemotePoseFetcher
+
+
+class LexiconManager:
+    """Keeps the lookup of a lexicon directory in sync with its files, without a restart.
+
+    The directory is polled for changes to `index.csv` and to the pose files it references. Changes are loaded
+    into a new index with the next version number, then swapped into the lookup at once. Only poses whose files
+    changed get a new version in their cache key, so every other cached pose stays warm.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        backup: PoseLookup = None,
+        fetcher: RemotePoseFetcher = None,
+        poll_interval: float = 5.0,
+        on_reload: Callable[[PoseLookup], None] = None,
+        executor: LookupExecutor = None,
+    ):
+        self.directory = directory
+        self.poll_interval = poll_interval
+        self.on_reload = on_reload
+
+        self.index_signature = self.signature(self.index_path)
+        self.rows = read_index(directory)
+        self.file_signatures = self.scan(self.rows)
+        self.lookup = PoseLookup(self.rows, directory=directory, backup=backup, fetcher=fetcher, executor=executor)
+
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.thread = None
+
+    @property
+    def index_path(self) -> str:
+        return os.path.join(self.directory, "index.csv")
+
+    @property
+    def version(self) -> int:
+        return self.lookup.index.version
+
+    def signature(self, path: str):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None
+        return stat.st_mtime_ns, stat.st_size
+
+    def scan(self, rows: list[dict]) -> dict:
+        paths = {row["path"] for row in rows if not RemotePoseFetcher.is_remote(row["path"])}
+        return {path: self.signature(os.path.join(self.directory, path)) for path in paths}
+
+    def check(self) -> bool:
+        """Reloads the lexicon if its index or any of its pose files changed, and returns whether it did"""
+        with self.lock:
+            index_signature = self.signature(self.index_path)
+            index_changed = index_signature != self.index_signature
+            rows = read_index(self.directory) if index_changed else self.rows
+
+            file_signatures = self.scan(rows)
+            if not index_changed and file_signatures == self.file_signatures:
+                return False
+
+            current = self.lookup.index
+            version = current.version + 1
+            file_versions = {
+                path: current.file_versions.get(path, 0) if signature == self.file_signatures.get(path) else version
+                for path, signature in file_signatures.items()
+            }
+
+            if index_changed:
+                index = self.lookup.make_index(rows, version=version, file_versions=file_versions)
+            else:
+                index = current._replace(version=version, file_versions=file_versions)
+            self.lookup.index = index
+
+            self.rows = rows
+            self.index_signature = index_signature
+            self.file_signatures = file_signatures
+
+        print(f"Reloaded lexicon {self.directory} (version {version})")
+        if self.on_reload is not None:
+            self.on_reload(self.lookup)
+        return True
+
+    def watch(self):
+        while not self.stop_event.wait(self.poll_interval):
+            try:
+                self.check()
+            except (OSError, ValueError, KeyError) as e:
+                # Most likely the index is being written, try again on the next poll
+                print(f"Could not reload lexicon {self.directory}: {e}")
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.watch, daemon=True)
+            self.thread.start()
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
@@ -1,26 +1,104 @@
-import math
 import os
+import threading
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor
+from typing import NamedTuple
 
+import numpy as np
 from pose_format import Pose
+from pose_format.numpy import NumPyPoseBody
+from pose_format.pose_header import PoseHeader
+from pose_format.utils.reader import BufferReader
 
+from spoken_to_signed.gloss_to_pose.concatenate import NormalizedPose, copy_pose
+from spoken_to_signed.gloss_to_pose.config import DEFAULT_CONFIG, PipelineConfig
 from spoken_to_signed.gloss_to_pose.languages import LANGUAGE_BACKUP
-from spoken_to_signed.gloss_to_pose.lookup.lru_cache import LRUCache
+from spoken_to_signed.gloss_to_pose.lookup.executor import LookupExecutor, shared_executor
+from spoken_to_signed.gloss_to_pose.lookup.remote import RemotePoseFetcher, frame_range
+from spoken_to_signed.gloss_to_pose.lru_cache import LRUCache
+from spoken_to_signed.gloss_to_pose.tracing import span
 from spoken_to_signed.text_to_gloss.types import Gloss
 
 
+class LexiconIndex(NamedTuple):
+    version: int
+    words_index: dict
+    glosses_index: dict
+    words_trie: dict
+    glosses_trie: dict
+    # Lexicon version at which each pose file last changed, part of the pose cache keys
+    file_versions: dict
+
+
+class PoseSlice(NamedTuple):
+    """Where the frames of a lexicon row are stored in its pose file, as added to the index by `build_index`"""
+
+    fps: float
+    layout: str
+    size: int
+    header_size: int
+    people: int
+    start_frame: int
+    end_frame: int
+    data_offset: int
+    confidence_offset: int
+
+    @classmethod
+    def from_row(cls, row: dict):
+        if not row.get("layout"):
+            return None
+        fps = row["fps"]
+        return cls(
+            fps=int(fps) if fps.isdigit() else float(fps),
+            layout=row["layout"],
+            **{field: int(row[field]) for field in cls._fields if field not in ("fps", "layout")},
+        )
+
+
 class PoseLookup:
-    def __init__(self, rows: list, directory: str = None, backup: "PoseLookup" = None, cache: LRUCache = None):
+    def __init__(
+        self,
+        rows: list,
+        directory: str = None,
+        backup: "PoseLookup" = None,
+        cache: LRUCache = None,
+        fetcher: RemotePoseFetcher = None,
+        executor: LookupExecutor = None,
+    ):
         self.directory = directory
 
-        self.words_index = self.make_dictionary_index(rows, based_on="words")
-        self.glosses_index = self.make_dictionary_index(rows, based_on="glosses")
+        # Replaced as a whole on reload, so concurrent lookups see either the old or the new index
+        self.index = self.make_index(rows)
 
         self.backup = backup
 
-        self.file_systems = {}
+        self.fetcher = fetcher if fetcher is not None else RemotePoseFetcher()
         self.cache = cache if cache is not None else LRUCache()
+        # Lookups of a sequence run concurrently on a pool shared with other lookups
+        self.executor = executor if executor is not None else shared_executor()
+
+        # Pose headers by layout, shared by all the files with the same header
+        self.headers = {}
+        self.headers_lock = threading.Lock()
+
+    def make_index(self, rows: list, version: int = 0, file_versions: dict = None) -> LexiconIndex:
+        words_index = self.make_dictionary_index(rows, based_on="words")
+        glosses_index = self.make_dictionary_index(rows, based_on="glosses")
+        return LexiconIndex(
+            version=version,
+            words_index=words_index,
+            glosses_index=glosses_index,
+            words_trie=self.make_phrase_trie(words_index),
+            glosses_trie=self.make_phrase_trie(glosses_index),
+            file_versions=file_versions if file_versions is not None else {},
+        )
+
+    @property
+    def words_index(self):
+        return self.index.words_index
+
+    @property
+    def glosses_index(self):
+        return self.index.glosses_index
 
     def make_dictionary_index(self, rows: list, based_on: str):
         # As an attempt to make the index more compact in memory, we store a dictionary with only what we need
@@ -35,22 +113,77 @@ class PoseLookup:
                     "start": int(d["start"]),
                     "end": int(d["end"]),
                     "priority": int(d["priority"]),
+                    # Compiled lexicons store poses already reduced (or not) and normalized, with the frames they
+                    # sign in, and where they were compiled from
+                    "preprocessed": d.get("preprocessed") == "1",
+                    "reduced": d.get("reduced") != "0",
+                    "signing": (int(d["signing_start"]), int(d["signing_end"])) if d.get("signing_end") else None,
+                    "source": (
+                        (d["source_path"], int(d["source_start"]), int(d["source_end"]))
+                        if d.get("source_path")
+                        else None
+                    ),
+                    "slice": PoseSlice.from_row(d),
                 }
             )
         return languages_dict
 
-    def read_pose(self, pose_path: str):
-        if pose_path.startswith("gs://"):
-            if "gcs" not in self.file_systems:
-                import gcsfs
+    def make_phrase_trie(self, dict_index):
+        # Token trie over the multi-word terms only, single words are already served by the dictionary index
+        languages_trie = defaultdict(lambda: defaultdict(dict))
+        for spoken_language, sp_values in dict_index.items():
+            for signed_language, terms in sp_values.items():
+                root = languages_trie[spoken_language][signed_language]
+                for term in terms:
+                    tokens = term.split()
+                    if len(tokens) < 2:
+                        continue
+                    node = root
+                    for token in tokens:
+                        node = node.setdefault(token, {})
+                    node[None] = term
+        return languages_trie
+
+    def match_phrase(self, trie: dict, tokens: list[str], start: int) -> int:
+        # Length of the longest phrase in the trie starting at `start`, 0 if there is none
+        node = trie
+        longest = 0
+        for i in range(start, len(tokens)):
+            node = node.get(tokens[i])
+            if node is None:
+                break
+            if None in node:
+                longest = i - start + 1
+        return longest
+
+    def segment_sequence(self, glosses: Gloss, spoken_language: str, signed_language: str) -> Gloss:
+        """Greedy longest-match segmentation, merging multi-word lexicon entries into a single (word, gloss) pair"""
+        glosses = [(word, gloss) for word, gloss in glosses if word != ""]
 
-                self.file_systems["gcs"] = gcsfs.GCSFileSystem(anon=True)
+        words = [word.lower() for word, _ in glosses]
+        gloss_tokens = [gloss.lower() for _, gloss in glosses]
+        index = self.index
+        words_trie = index.words_trie.get(spoken_language, {}).get(signed_language, {})
+        glosses_trie = index.glosses_trie.get(spoken_language, {}).get(signed_language, {})
+        tries = [(words_trie, words), (glosses_trie, words), (glosses_trie, gloss_tokens)]
 
-            with self.file_systems["gcs"].open(pose_path, "rb") as f:
-                return Pose.read(f.read())
+        segments = []
+        i = 0
+        while i < len(glosses):
+            length = max(self.match_phrase(trie, tokens, i) for trie, tokens in tries)
+            if length < 2:
+                segments.append(glosses[i])
+                i += 1
+                continue
 
-        if pose_path.startswith("https://"):
-            raise NotImplementedError("Can't access pose files from https endpoint")
+            phrase = glosses[i : i + length]
+            segments.append((" ".join(word for word, _ in phrase), " ".join(gloss for _, gloss in phrase)))
+            i += length
+        return segments
+
+    def read_pose(self, pose_path: str):
+        if self.fetcher.is_remote(pose_path):
+            return Pose.read(self.fetcher.read(pose_path))
 
         if self.directory is None:
             raise ValueError("Can't access pose files without specifying a directory")
@@ -59,19 +192,110 @@ class PoseLookup:
         with open(pose_path, "rb") as f:
             return Pose.read(f.read())
 
-    def get_pose(self, row):
+    def source_row(self, row: dict) -> dict:
+        # The row of the pose a compiled entry was compiled from
+        if row["source"] is None:
+            state = "reduced" if row["reduced"] else "not reduced"
+            raise ValueError(f"{row['path']} was compiled {state}, and the index does not say where its source is")
+        path, start, end = row["source"]
+        return {
+            **row,
+            "path": path,
+            "start": start,
+            "end": end,
+            "preprocessed": False,
+            "signing": None,
+            "slice": None,
+            "source": None,
+        }
+
+    def get_pose(self, row, config: PipelineConfig = DEFAULT_CONFIG):
+        # Compiled entries can't be reduced (or restored) to the points of `config`, so its source is read instead
+        if row["preprocessed"] and row["reduced"] != config.is_reduce_holistic:
+            row = self.source_row(row)
+
+        pose = self.load_pose(row)
+        # Identifies the entry (and the version of its file), for caches of what is computed from it
+        entry = (self.directory, row["path"], row["start"], row["end"], self.index.file_versions.get(row["path"], 0))
+        if row["preprocessed"]:
+            return NormalizedPose(pose.header, pose.body, signing=row["signing"], entry=entry)
+        pose.entry = entry
+        return pose
+
+    def load_pose(self, row):
+        # Remote poses are only downloaded for the requested range, so they are cached per range
+        if self.fetcher.is_remote(row["path"]):
+            cache_key = f"{row['path']}#{row['start']}-{row['end']}"
+            pose = self.cache.get(cache_key)
+            if pose is None:
+                pose = self.fetcher.read_pose(row["path"], row["start"], row["end"])
+                self.cache.set(cache_key, pose)
+            return Pose(pose.header, pose.body[:])
+
+        if row["slice"] is not None:
+            pose = self.load_pose_slice(row)
+            if pose is not None:
+                return pose
+
         # Manage pose cache
-        cached_pose = self.cache.get(row["path"])
-        if cached_pose is None:
+        cache_key = (row["path"], self.index.file_versions.get(row["path"], 0))
+        pose = self.cache.get(cache_key)
+        if pose is None:
             pose = self.read_pose(row["path"])
-            self.cache.set(row["path"], pose)
-        pose = self.cache.get(row["path"])
+            self.cache.set(cache_key, pose)
 
-        frame_time = 1000 / pose.body.fps
-        start_frame = math.floor(row["start"] // frame_time)
-        end_frame = math.ceil(row["end"] // frame_time) if row["end"] > 0 else -1
+        start_frame, end_frame = frame_range(pose.body.fps, row["start"], row["end"])
         return Pose(pose.header, pose.body[start_frame:end_frame])
 
+    def get_header(self, pose_slice: PoseSlice, f) -> PoseHeader:
+        with self.headers_lock:
+            header = self.headers.get(pose_slice.layout)
+        if header is None:
+            f.seek(0)
+            header = PoseHeader.read(BufferReader(f.read(pose_slice.header_size)))
+            with self.headers_lock:
+                self.headers[pose_slice.layout] = header
+        return header
+
+    def read_pose_slice(self, pose_path: str, pose_slice: PoseSlice):
+        with open(pose_path, "rb") as f:
+            # The file changed since the index was built, so its offsets can't be trusted
+            if os.fstat(f.fileno()).st_size != pose_slice.size:
+                return None
+
+            header = self.get_header(pose_slice, f)
+            frames = pose_slice.end_frame - pose_slice.start_frame
+            points = sum(len(c.points) for c in header.components)
+            shape = (frames, pose_slice.people, points)
+
+            f.seek(pose_slice.data_offset)
+            data = np.fromfile(f, dtype="<f4", count=int(np.prod(shape)) * header.num_dims())
+            f.seek(pose_slice.confidence_offset)
+            confidence = np.fromfile(f, dtype="<f4", count=int(np.prod(shape)))
+
+        body = NumPyPoseBody(pose_slice.fps, data.reshape((*shape, header.num_dims())), confidence.reshape(shape))
+        return Pose(header, body)
+
+    def load_pose_slice(self, row):
+        # Indexed rows are read straight from their offsets, without parsing the whole file
+        if self.directory is None:
+            raise ValueError("Can't access pose files without specifying a directory")
+
+        pose_slice = row["slice"]
+        cache_key = (
+            row["path"],
+            self.index.file_versions.get(row["path"], 0),
+            pose_slice.start_frame,
+            pose_slice.end_frame,
+        )
+        pose = self.cache.get(cache_key)
+        if pose is None:
+            pose = self.read_pose_slice(os.path.join(self.directory, row["path"]), pose_slice)
+            if pose is None:
+                return None
+            self.cache.set(cache_key, pose)
+        return Pose(pose.header, pose.body[:])
+
     def get_best_row(self, rows, term: str):
         # Sort by priority: lower is "better"
         rows = sorted(rows, key=lambda x: x["priority"])
@@ -82,11 +306,12 @@ class PoseLookup:
         # Return the highest priority row
         return rows[0]
 
-    def lookup(self, word: str, gloss: str, spoken_language: str, signed_language: str, source: str = None) -> Pose:
+    def find_row(self, word: str, gloss: str, spoken_language: str, signed_language: str):
+        index = self.index
         lookup_list = [
-            (self.words_index, (spoken_language, signed_language, word)),
-            (self.glosses_index, (spoken_language, signed_language, word)),
-            (self.glosses_index, (spoken_language, signed_language, gloss)),
+            (index.words_index, (spoken_language, signed_language, word)),
+            (index.glosses_index, (spoken_language, signed_language, word)),
+            (index.glosses_index, (spoken_language, signed_language, gloss)),
         ]
 
         for dict_index, (spoken_language, signed_language, term) in lookup_list:
@@ -95,37 +320,85 @@ class PoseLookup:
                     lower_term = term.lower()
                     if lower_term in dict_index[spoken_language][signed_language]:
                         rows = dict_index[spoken_language][signed_language][lower_term]
-                        return self.get_pose(self.get_best_row(rows, term))
+                        return self.get_best_row(rows, term)
 
         # Backup strategy: revert to backup sign language
         if signed_language in LANGUAGE_BACKUP:
-            return self.lookup(word, gloss, spoken_language, LANGUAGE_BACKUP[signed_language], source)
+            return self.find_row(word, gloss, spoken_language, LANGUAGE_BACKUP[signed_language])
+
+        return None
+
+    def lookup(
+        self,
+        word: str,
+        gloss: str,
+        spoken_language: str,
+        signed_language: str,
+        source: str = None,
+        config: PipelineConfig = DEFAULT_CONFIG,
+    ) -> Pose:
+        row = self.find_row(word, gloss, spoken_language, signed_language)
+        if row is not None:
+            return self.get_pose(row, config)
 
         # Backup strategy: revert to fingerspelling
         if self.backup is not None:
-            return self.backup.lookup(word, gloss, spoken_language, signed_language, source)
+            return self.backup.lookup(word, gloss, spoken_language, signed_language, source, config)
 
         raise FileNotFoundError
 
-    def lookup_sequence(self, glosses: Gloss, spoken_language: str, signed_language: str, source: str = None):
+    def lookup_segments(
+        self, segments: Gloss, spoken_language: str, signed_language: str, config: PipelineConfig = DEFAULT_CONFIG
+    ) -> dict:
+        """Looks up every distinct (word, gloss) segment once, concurrently, None for segments without a pose"""
+
         def lookup_pair(pair):
             word, gloss = pair
             if word == "":
                 return None
 
             try:
-                return self.lookup(word, gloss, spoken_language, signed_language)
+                return self.lookup(word, gloss, spoken_language, signed_language, config=config)
             except FileNotFoundError as e:
                 print(e)
                 return None
 
-        with ThreadPoolExecutor() as executor:
-            results = executor.map(lookup_pair, glosses)
+        unique_segments = list(dict.fromkeys(segments))
+        with span("lookup", segments=len(unique_segments)):
+            return dict(zip(unique_segments, self.executor.map(lookup_pair, unique_segments)))
+
+    def lookup_sequence(
+        self,
+        glosses: Gloss,
+        spoken_language: str,
+        signed_language: str,
+        source: str = None,
+        config: PipelineConfig = DEFAULT_CONFIG,
+    ):
+        segments = self.segment_sequence(glosses, spoken_language, signed_language)
+        results = self.lookup_segments(segments, spoken_language, signed_language, config)
 
-        poses = [result for result in results if result is not None]  # Filter out None results
+        # Repeated segments get a pose of their own, as concatenation modifies the poses
+        poses = []
+        seen = set()
+        for segment in segments:
+            pose = results[segment]
+            if pose is not None:
+                poses.append(copy_pose(pose) if segment in seen else pose)
+                seen.add(segment)
 
         if len(poses) == 0:
             gloss_sequence = " ".join([f"{word}/{gloss}" for word, gloss in glosses])
             raise Exception(f"No poses found for {gloss_sequence}")
 
         return poses
+
+    def prefetch(self, glosses: Gloss, spoken_language: str, signed_language: str):
+        """Loads all the lexicon entries needed for a gloss sequence into the pose cache, concurrently"""
+        rows = {}
+        for word, gloss in self.segment_sequence(glosses, spoken_language, signed_language):
+            row = self.find_row(word, gloss, spoken_language, signed_language)
+            if row is not None:
+                rows[(row["path"], row["start"], row["end"])] = row
+
+        self.executor.map(self.get_pose, rows.values())
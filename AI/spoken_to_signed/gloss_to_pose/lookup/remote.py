@@ -0,0 +1,274 @@
+import hashlib
+import http.client
+import io
+import os
+import threading
+import urllib.parse
+
+from pose_format import Pose
+from pose_format.pose_body import EmptyPoseBody
+
+
+def frame_range(fps: float, start: int, end: int) -> tuple[int, int]:
+    # Converts a lexicon row's start and end (in milliseconds) to frames. An end of 0 means "until the end".
+    frame_time = 1000 / fps
+    start_frame = int(start // frame_time)
+    end_frame = int(end // frame_time) if end > 0 else -1
+    return start_frame, end_frame
+
+
+class HTTPConnectionPool:
+    """Keep-alive connections to HTTP(S) hosts, reused across requests and bounded per host"""
+
+    def __init__(self, max_connections: int = 8, timeout: float = 30):
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.idle = {}
+        self.slots = {}
+        self.lock = threading.Lock()
+
+    def _host_state(self, host: tuple[str, str]):
+        with self.lock:
+            if host not in self.slots:
+                self.slots[host] = threading.BoundedSemaphore(self.max_connections)
+                self.idle[host] = []
+            return self.slots[host], self.idle[host]
+
+    def _connect(self, scheme: str, netloc: str) -> http.client.HTTPConnection:
+        if scheme == "https":
+            return http.client.HTTPSConnection(netloc, timeout=self.timeout)
+        return http.client.HTTPConnection(netloc, timeout=self.timeout)
+
+    def request(self, url: str, headers: dict = None) -> tuple[int, dict, bytes]:
+        parsed = urllib.parse.urlsplit(url)
+        path = parsed.path + (f"?{parsed.query}" if parsed.query else "")
+        host = (parsed.scheme, parsed.netloc)
+        slots, idle = self._host_state(host)
+
+        with slots:
+            with self.lock:
+                connection = idle.pop() if idle else None
+
+            # An idle connection may have been closed by the server, so retry once on a fresh one
+            for attempt in range(2):
+                if connection is None:
+                    connection = self._connect(*host)
+                try:
+                    connection.request("GET", path, headers=headers or {})
+                    response = connection.getresponse()
+                    body = response.read()
+                    break
+                except (http.client.HTTPException, OSError):
+                    connection.close()
+                    connection = None
+                    if attempt == 1:
+                        raise
+
+            if response.will_close:
+                connection.close()
+            else:
+                with self.lock:
+                    idle.append(connection)
+
+        return response.status, {k.lower(): v for k, v in response.getheaders()}, body
+
+
+class HTTPRangeFile(io.RawIOBase):
+    """Seekable read-only file over HTTP, only downloading the byte ranges that are read"""
+
+    def __init__(self, pool: HTTPConnectionPool, url: str, min_request_size: int = 64 * 1024):
+        super().__init__()
+        self.pool = pool
+        self.url = url
+        self.min_request_size = min_request_size
+        self.position = 0
+        self.size = None
+        self.chunks = []  # (offset, bytes) already downloaded
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self.position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.position
+        elif whence == io.SEEK_END:
+            offset += self.get_size()
+        self.position = max(0, offset)
+        return self.position
+
+    def get_size(self) -> int:
+        if self.size is None:
+            self._download(0, 1)
+        return self.size
+
+    def _download(self, offset: int, length: int = None):
+        last_byte = offset + length - 1 if length is not None else ""
+        status, headers, body = self.pool.request(self.url, {"Range": f"bytes={offset}-{last_byte}"})
+        if status == 206:
+            self.size = int(headers["content-range"].split("/")[-1])
+            self.chunks.append((offset, body))
+        elif status == 200:
+            # The server does not support ranges and sent the whole file
+            self.size = len(body)
+            self.chunks = [(0, body)]
+        elif status == 416:
+            self.size = offset
+        else:
+            raise FileNotFoundError(f"Could not read {self.url}, HTTP status {status}")
+
+    def _cached(self, offset: int, length: int) -> bytes:
+        # The bytes at `offset` that were already downloaded, up to `length`
+        for chunk_offset, chunk in self.chunks:
+            if chunk_offset <= offset < chunk_offset + len(chunk):
+                return chunk[offset - chunk_offset : offset - chunk_offset + length]
+        return b""
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            if self.size is None:
+                self._download(self.position)
+            size = self.size - self.position
+        if self.size is not None:
+            size = min(size, self.size - self.position)
+        if size <= 0:
+            return b""
+
+        data = self._cached(self.position, size)
+        if len(data) < size:
+            # Only download what is missing
+            offset = self.position + len(data)
+            self._download(offset, max(size - len(data), self.min_request_size))
+            data += self._cached(offset, min(size, self.size - self.position) - len(data))
+
+        self.position += len(data)
+        return data
+
+    def readinto(self, buffer) -> int:
+        data = self.read(len(buffer))
+        buffer[: len(data)] = data
+        return len(data)
+
+
+class DiskCache:
+    """Read-through cache of files on disk, evicting the least recently used ones above `max_bytes`"""
+
+    def __init__(self, directory: str, max_bytes: int = 512 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self.total_bytes = sum(size for _, size, _ in self.entries())
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf-8")).hexdigest() + ".pose")
+
+    def get(self, key: str):
+        path = self.path(key)
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        os.utime(path)  # Mark as recently used
+        return data
+
+    def set(self, key: str, data: bytes):
+        path = self.path(key)
+        temporary_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temporary_path, "wb") as f:
+            f.write(data)
+        os.replace(temporary_path, path)
+
+        with self.lock:
+            self.total_bytes += len(data)
+            if self.total_bytes > self.max_bytes:
+                self.evict()
+
+    def entries(self) -> list[tuple[float, int, str]]:
+        entries = []
+        for entry in os.scandir(self.directory):
+            if entry.name.endswith(".pose"):
+                stat = entry.stat()
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+        return entries
+
+    def evict(self):
+        # Directory listing is only needed when over the limit, it also corrects the running total
+        entries = self.entries()
+        self.total_bytes = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            self.total_bytes -= size
+
+
+class RemotePoseFetcher:
+    """Reads pose files from `gs://`, `http://` and `https://` locations.
+
+    HTTP connections are pooled, slices of a pose are read with range requests, and when a `cache_directory` is
+    given, everything read is kept on disk up to `cache_max_bytes`.
+    """
+
+    def __init__(self, cache_directory: str = None, cache_max_bytes: int = 512 * 1024 * 1024, max_connections=8):
+        self.pool = HTTPConnectionPool(max_connections=max_connections)
+        self.disk_cache = DiskCache(cache_directory, cache_max_bytes) if cache_directory is not None else None
+        self.file_systems = {}
+
+    @staticmethod
+    def is_remote(path: str) -> bool:
+        return path.startswith(("gs://", "http://", "https://"))
+
+    def open(self, url: str):
+        if url.startswith("gs://"):
+            if "gcs" not in self.file_systems:
+                import gcsfs
+
+                self.file_systems["gcs"] = gcsfs.GCSFileSystem(anon=True)
+            return self.file_systems["gcs"].open(url, "rb")
+
+        if url.startswith(("http://", "https://")):
+            return HTTPRangeFile(self.pool, url)
+
+        raise ValueError(f"Unsupported remote location {url}")
+
+    def read(self, url: str) -> bytes:
+        data = self.disk_cache.get(url) if self.disk_cache is not None else None
+        if data is None:
+            with self.open(url) as f:
+                data = f.read()
+            if self.disk_cache is not None:
+                self.disk_cache.set(url, data)
+        return data
+
+    def read_pose(self, url: str, start: int = 0, end: int = 0) -> Pose:
+        """Reads the frames between `start` and `end` (in milliseconds, as in the lexicon index) of a pose"""
+        cache_key = f"{url}#{start}-{end}"
+        if self.disk_cache is not None:
+            data = self.disk_cache.get(cache_key)
+            if data is not None:
+                return Pose.read(data)
+
+        with self.open(url) as f:
+            # Only the header is read at first, then the requested frames
+            info = Pose.read(f, pose_body=EmptyPoseBody)
+            start_frame, end_frame = frame_range(info.body.fps, start, end)
+            if end_frame < 0:
+                end_frame += len(info.body.data)
+            f.seek(0)
+            pose = Pose.read(f, start_frame=start_frame, end_frame=end_frame)
+
+        if self.disk_cache is not None:
+            buffer = io.BytesIO()
+            pose.write(buffer)
+            self.disk_cache.set(cache_key, buffer.getvalue())
+        return pose
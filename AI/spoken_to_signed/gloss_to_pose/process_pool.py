@@ -0,0 +1,219 @@
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from multiprocessing import shared_memory
+from typing import NamedTuple
+
+import numpy as np
+from pose_format import Pose
+from pose_format.numpy import NumPyPoseBody
+from pose_format.pose_header import PoseHeader
+
+from spoken_to_signed.gloss_to_pose import glosses_to_pose
+from spoken_to_signed.gloss_to_pose.config import DEFAULT_CONFIG, PipelineConfig
+from spoken_to_signed.gloss_to_pose.lookup.fingerspelling_lookup import FingerspellingPoseLookup
+from spoken_to_signed.gloss_to_pose.lookup.lexicon_manager import LexiconManager
+from spoken_to_signed.gloss_to_pose.lookup.remote import RemotePoseFetcher
+from spoken_to_signed.gloss_to_pose.tracing import current_span_id, current_trace, record
+from spoken_to_signed.gloss_to_pose.transition_cache import TransitionCache
+from spoken_to_signed.text_to_gloss.types import Gloss
+
+
+class SharedPose(NamedTuple):
+    """A pose whose arrays are in a shared memory block, only this description is pickled between processes"""
+
+    name: str
+    header: PoseHeader
+    fps: float
+    shape: tuple
+    dtype: str
+    confidence_dtype: str
+
+
+def _aligned(size: int) -> int:
+    return (size + 7) // 8 * 8
+
+
+def _array_offsets(shared: SharedPose) -> tuple[int, int, int]:
+    # Data, confidence then mask, each aligned to 8 bytes
+    points = int(np.prod(shared.shape[:-1]))
+    data_size = _aligned(points * shared.shape[-1] * np.dtype(shared.dtype).itemsize)
+    confidence_size = _aligned(points * np.dtype(shared.confidence_dtype).itemsize)
+    return data_size, confidence_size, data_size + confidence_size + points * shared.shape[-1]
+
+
+def write_shared_pose(pose: Pose) -> SharedPose:
+    """Copies the pose arrays into a new shared memory block, which `read_shared_pose` then frees"""
+    data = np.ma.getdata(pose.body.data)
+    mask = np.ma.getmaskarray(pose.body.data)
+    confidence = np.asarray(pose.body.confidence)
+    shared = SharedPose(
+        name="",
+        header=pose.header,
+        fps=pose.body.fps,
+        shape=data.shape,
+        dtype=data.dtype.str,
+        confidence_dtype=confidence.dtype.str,
+    )
+    data_size, confidence_size, size = _array_offsets(shared)
+
+    block = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    try:
+        buffer = block.buf
+        np.ndarray(data.shape, data.dtype, buffer)[:] = data
+        np.ndarray(confidence.shape, confidence.dtype, buffer, offset=data_size)[:] = confidence
+        np.ndarray(mask.shape, bool, buffer, offset=data_size + confidence_size)[:] = mask
+        del buffer
+    finally:
+        block.close()
+    return shared._replace(name=block.name)
+
+
+def read_shared_pose(shared: SharedPose) -> Pose:
+    data_size, confidence_size, _ = _array_offsets(shared)
+    block = shared_memory.SharedMemory(name=shared.name)
+    try:
+        buffer = block.buf
+        data = np.ndarray(shared.shape, shared.dtype, buffer).copy()
+        confidence = np.ndarray(shared.shape[:-1], shared.confidence_dtype, buffer, offset=data_size).copy()
+        mask = np.ndarray(shared.shape, bool, buffer, offset=data_size + confidence_size).copy()
+        del buffer
+    finally:
+        block.close()
+        block.unlink()
+
+    body = NumPyPoseBody(shared.fps, data, confidence)
+    # The constructor masks by confidence, the mask of the pose as it was computed is kept instead
+    body.data = np.ma.array(data, mask=mask)
+    return Pose(shared.header, body)
+
+
+# The lexicon managers of a worker process, kept warm across jobs
+_WORKER_MANAGERS = {}
+_WORKER_MANAGERS_LOCK = threading.Lock()
+_WORKER_OPTIONS = {}
+
+
+def _init_worker(options: dict):
+    _WORKER_OPTIONS.update(options)
+    _WORKER_OPTIONS["transition_cache"] = None
+    if options["transition_cache_size"] > 0:
+        _WORKER_OPTIONS["transition_cache"] = TransitionCache(maxsize=options["transition_cache_size"])
+    _WORKER_OPTIONS["fetcher"] = RemotePoseFetcher(
+        cache_directory=options["cache_directory"], cache_max_bytes=options["cache_max_bytes"]
+    )
+    _WORKER_OPTIONS["fingerspelling"] = FingerspellingPoseLookup()
+    # Lexicons are warmed up in the background, so the first jobs of the worker do not wait for it
+    if options["warm_up"]:
+        threading.Thread(target=_warm_up_worker, args=(options["warm_up"],), daemon=True).start()
+
+
+def _worker_lookup(directory: str):
+    with _WORKER_MANAGERS_LOCK:
+        manager = _WORKER_MANAGERS.get(directory)
+        if manager is None:
+            manager = LexiconManager(
+                directory,
+                backup=_WORKER_OPTIONS["fingerspelling"],
+                fetcher=_WORKER_OPTIONS["fetcher"],
+                poll_interval=_WORKER_OPTIONS["poll_interval"],
+            )
+            if _WORKER_OPTIONS["poll_interval"] > 0:
+                manager.start()
+            _WORKER_MANAGERS[directory] = manager
+    return manager.lookup
+
+
+def _warm_up_worker(warm_up: dict):
+    for directory, by_language in warm_up.items():
+        try:
+            lookup = _worker_lookup(directory)
+            for (spoken_language, signed_language), glosses in by_language.items():
+                lookup.prefetch(glosses[: lookup.cache.maxsize], spoken_language, signed_language)
+        except (OSError, ValueError, KeyError) as e:
+            # Warm-up only saves time, jobs still load what it could not
+            print(f"Could not warm up lexicon {directory}: {e}")
+
+
+def _started():
+    pass
+
+
+def _worker_glosses_to_pose(
+    sentences: list[Gloss],
+    directory: str,
+    spoken_language: str,
+    signed_language: str,
+    config: PipelineConfig,
+    traced: bool,
+):
+    # The pose, and the spans it was made in if the caller is tracing
+    lookup = _worker_lookup(directory)
+    transition_cache = _WORKER_OPTIONS["transition_cache"]
+    with record() if traced else nullcontext() as trace:
+        pose = glosses_to_pose(
+            sentences, lookup, spoken_language, signed_language, config=config, transition_cache=transition_cache
+        )
+    return write_shared_pose(pose), trace.spans if traced else None
+
+
+class GlossToPoseProcessPool:
+    """Runs `glosses_to_pose` in worker processes, so concurrent jobs do not contend for the GIL.
+
+    Every worker keeps its own lexicon lookups (with hot-reload), pose caches and transition cache, warm across the
+    jobs it runs. As it starts, a worker loads the glosses of `warm_up` (by lexicon directory, then by
+    `(spoken_language, signed_language)`) into its pose caches. The resulting pose is handed back in a shared memory
+    block rather than pickled. The `PipelineConfig` of each call is sent along with it, and when the call is traced,
+    the spans of the worker are added to the trace.
+    """
+
+    def __init__(
+        self,
+        processes: int,
+        poll_interval: float = 5.0,
+        cache_directory: str = None,
+        cache_max_bytes: int = 512 * 1024 * 1024,
+        transition_cache_size: int = 10000,
+        warm_up: dict = None,
+    ):
+        self.processes = processes
+        options = {
+            "poll_interval": poll_interval,
+            "cache_directory": cache_directory,
+            "cache_max_bytes": cache_max_bytes,
+            "transition_cache_size": transition_cache_size,
+            "warm_up": warm_up or {},
+        }
+        # Spawned rather than forked, as the parent may already run threads
+        self.executor = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker,
+            initargs=(options,),
+        )
+
+    def glosses_to_pose(
+        self,
+        sentences: list[Gloss],
+        directory: str,
+        spoken_language: str,
+        signed_language: str,
+        config: PipelineConfig = DEFAULT_CONFIG,
+    ):
+        trace = current_trace()
+        future = self.executor.submit(
+            _worker_glosses_to_pose, sentences, directory, spoken_language, signed_language, config, trace is not None
+        )
+        shared, spans = future.result()
+        if spans is not None:
+            trace.adopt(spans, current_span_id())
+        return read_shared_pose(shared)
+
+    def start(self):
+        # Workers are otherwise started by the first jobs, start them all so they warm up before
+        for future in [self.executor.submit(_started) for _ in range(self.processes)]:
+            future.result()
+
+    def shutdown(self):
+        self.executor.shutdown(wait=True)
@@ -4,47 +4,264 @@ import numpy as np
 import scipy.signal
 from pose_format import Pose
 from pose_format.numpy import NumPyPoseBody
-from scipy.spatial.distance import cdist
 
+from spoken_to_signed.gloss_to_pose.config import (
+    CONNECTION_KEYPOINTS,
+    DEFAULT_CONFIG,
+    PRECISIONS,
+    SAVGOL_COMPONENTS,
+    PipelineConfig,
+)
+from spoken_to_signed.gloss_to_pose.header_layout import HeaderLayout, get_header_layout
+from spoken_to_signed.gloss_to_pose.tracing import span
 
-def pose_savgol_filter(pose: Pose):
-  
-    [face_component] = [c for c in pose.header.components if c.name == "FACE_LANDMARKS"]
-    face_range = range(
-        pose.header._get_point_index("FACE_LANDMARKS", face_component.points[0]),
-        pose.header._get_point_index("FACE_LANDMARKS", face_component.points[-1]),
-    )
 
-    _, _, points, dims = pose.body.data.shape
-    for p in range(points):
-        if p not in face_range:
-            for d in range(dims):
-                pose.body.data[:, 0, p, d] = scipy.signal.savgol_filter(pose.body.data[:, 0, p, d], 3, 1)
+def savgol_point_settings(header, window_length: int, polyorder: int, components: dict) -> dict:
+    # Groups the point indices by the (window_length, polyorder) they are smoothed with, once per header layout
+    layout = get_header_layout(header)
+    key = ("savgol", window_length, polyorder, tuple(sorted(components.items())))
+    return layout.cached(key, lambda: group_savgol_points(layout, window_length, polyorder, components))
+
+
+def group_savgol_points(layout: HeaderLayout, window_length: int, polyorder: int, components: dict) -> dict:
+    settings = [(window_length, polyorder)] * layout.total_points
+    for name, component_settings in components.items():
+        mask = layout.component_mask([name])
+        # The default settings still smooth the last face point, as the filter always did
+        if components == SAVGOL_COMPONENTS and name == "FACE_LANDMARKS":
+            mask = layout.face_mask.copy()
+            mask[np.flatnonzero(mask)[-1:]] = False
+        for p in np.flatnonzero(mask):
+            settings[p] = component_settings
+
+    groups = {}
+    for p, point_settings in enumerate(settings):
+        if point_settings is not None:
+            groups.setdefault(point_settings, []).append(p)
+    return {point_settings: np.array(indices) for point_settings, indices in groups.items()}
+
+
+def pose_savgol_filter(pose: Pose, window_length: int = 3, polyorder: int = 1, components: dict = None) -> Pose:
+    # components is a dict like `SAVGOL_COMPONENTS`, or its `freeze_points` pairs
+    components = dict(components) if components is not None else SAVGOL_COMPONENTS
+
+    # The filter runs once along the time axis for all the points sharing the same settings
+    groups = savgol_point_settings(pose.header, window_length, polyorder, components)
+    for (group_window, group_order), indices in groups.items():
+        data = np.asarray(pose.body.data[:, 0, indices, :])
+        pose.body.data[:, 0, indices, :] = scipy.signal.savgol_filter(data, group_window, group_order, axis=0)
     return pose
 
 
-def create_padding(time: float, example: Pose) -> NumPyPoseBody:
-    fps = example.body.fps
-    padding_frames = int(time * fps)
-    data_shape = example.body.data.shape
-    return NumPyPoseBody(
-        fps=fps,
-        data=np.zeros(shape=(padding_frames, data_shape[1], data_shape[2], data_shape[3])),
-        confidence=np.zeros(shape=(padding_frames, data_shape[1], data_shape[2])),
-    )
+# Easing curves of `fill_gaps`, from the progress `u` in [0, 1] through a gap
+GAP_EASINGS = {
+    "linear": lambda u: u,
+    "minimum_jerk": lambda u: u**3 * (10 - 15 * u + 6 * u**2),
+    "cubic": None,  # Monotone Hermite spline, following the velocities at both ends of the gap
+}
+
+
+def presence_neighbours(present: np.ndarray) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """For every frame and point, the last frame before it where the point is present (-1 if none), and the first
+    frame from it on where the point is present (the number of frames if none)"""
+    frames, lanes = present.shape
+    frame_indices = np.broadcast_to(np.arange(frames)[:, None], (frames, lanes))
+    seen = np.maximum.accumulate(np.where(present, frame_indices, -1), axis=0)
+    previous = np.concatenate([np.full((1, lanes), -1), seen[:-1]])
+    upcoming = np.minimum.accumulate(np.where(present, frame_indices, frames)[::-1], axis=0)[::-1]
+    return frame_indices, previous, upcoming
+
+
+def interpolate_gaps(data: np.ndarray, confidence: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Linearly fills the frames where a point is missing, between the frames where it is present.
+
+    Gives the same values as `NumPyPoseBody.interpolate(kind="linear")` at the same fps, with one pass over all
+    points instead of a loop per point. Points are zeroed before their first and after their last appearance.
+    """
+    frames = len(data)
+    if frames == 1:
+        raise ValueError("Can't interpolate single frame")
+
+    dims = data.shape[-1]
+    confidence_lanes = confidence.reshape(frames, -1)
+    lanes = confidence_lanes.shape[1]
+    values = np.concatenate([data.reshape(frames, lanes, dims), confidence_lanes[:, :, None]], axis=2)
+    steps = np.linspace(0, 1, frames, dtype=data.dtype)
+
+    present = confidence_lanes != 0
+    frame_indices, previous, upcoming = presence_neighbours(present)
+    upcoming = np.concatenate([upcoming, np.full((1, lanes), frames)])
+
+    lane_indices = np.arange(lanes)
+    first = upcoming[0]
+    last = np.where(present[-1], frames - 1, previous[-1])
+    # The first appearance interpolates towards the next one, every other frame from the previous appearance
+    at_first = frame_indices == first
+    low = np.where(at_first, first, previous).clip(0, frames - 1)
+    high = np.where(at_first, upcoming[np.minimum(first + 1, frames), lane_indices], upcoming[:-1]).clip(0, frames - 1)
+
+    flat_values = values.reshape(frames * lanes, dims + 1)
+    low_values = flat_values.take((low * lanes + lane_indices).ravel(), axis=0).reshape(values.shape)
+    high_values = flat_values.take((high * lanes + lane_indices).ravel(), axis=0).reshape(values.shape)
+
+    # Mostly in place, in the same order of operations and types as `interp1d`, so the results are identical
+    with np.errstate(divide="ignore", invalid="ignore"):
+        interpolated = high_values - low_values
+        interpolated = interpolated / (steps[high] - steps[low])[:, :, None]
+        interpolated *= (steps[:, None] - steps[low])[:, :, None]
+        interpolated += low_values
+
+    # Points seen only once keep their single frame
+    single = first == last
+    interpolated[:, single] = low_values[:, single]
+    interpolated[(frame_indices < first) | (frame_indices > last)] = 0
+
+    new_data = interpolated[:, :, :dims].reshape(data.shape)
+    new_confidence = interpolated[:, :, dims].reshape(confidence.shape)
+    return new_data, new_confidence
+
+
+def fill_gaps(data: np.ndarray, confidence: np.ndarray, easing="linear") -> tuple[np.ndarray, np.ndarray]:
+    """Fills, in place, only the frames where a point is missing between two frames where it is present.
+
+    Every gap is eased from the frame before it to the frame after it, so the cost grows with the gaps rather than
+    with the whole sequence, and frames where points are present are left as they are. Confidence is filled
+    linearly. Like `interpolate_gaps`, points are zeroed before their first and after their last appearance.
+    """
+    if easing not in GAP_EASINGS:
+        raise ValueError(f"Unknown easing {easing}, expected one of {list(GAP_EASINGS)}")
+
+    frames = len(data)
+    dims = data.shape[-1]
+    confidence_lanes = confidence.reshape(frames, -1)
+    lanes = confidence_lanes.shape[1]
+    data_lanes = data.reshape(frames, lanes, dims)
+
+    present = confidence_lanes != 0
+    frame_indices, previous, upcoming = presence_neighbours(present)
+    outside = (previous < 0) & ~present | (upcoming == frames)
+    data_lanes[outside] = 0
+    confidence_lanes[outside] = 0
+
+    gap_frames, gap_lanes = np.nonzero(~present & ~outside)
+    if len(gap_frames) == 0:
+        return data, confidence
 
+    start = previous[gap_frames, gap_lanes]
+    end = upcoming[gap_frames, gap_lanes]
+    u = ((gap_frames - start) / (end - start)).astype(data.dtype, copy=False)[:, None]
+    start_values = data_lanes[start, gap_lanes]
+    end_values = data_lanes[end, gap_lanes]
 
-def concatenate_poses(poses: list[Pose], padding: NumPyPoseBody, interpolation="linear") -> Pose:
-    # Add padding to all poses except the last one
-    for pose in poses[:-1]:
-        pose.body.data = np.concatenate((pose.body.data, padding.data))
-        pose.body.confidence = np.concatenate((pose.body.confidence, padding.confidence))
+    if easing == "cubic":
+        # Velocities from the neighbouring frames outside the gap, or 0 where the point is missing there
+        before = np.maximum(start - 1, 0)
+        after = np.minimum(end + 1, frames - 1)
+        has_before = ((start > 0) & present[before, gap_lanes])[:, None]
+        has_after = ((end < frames - 1) & present[after, gap_lanes])[:, None]
+        span = (end - start)[:, None]
+        start_tangent = np.where(has_before, start_values - data_lanes[before, gap_lanes], 0) * span
+        end_tangent = np.where(has_after, data_lanes[after, gap_lanes] - end_values, 0) * span
 
-    # Concatenate all tensors
-    new_data = np.concatenate([pose.body.data for pose in poses])
-    new_conf = np.concatenate([pose.body.confidence for pose in poses])
-    new_body = NumPyPoseBody(fps=poses[0].body.fps, data=new_data, confidence=new_conf)
-    new_body = new_body.interpolate(kind=interpolation)
+        # Limited like Fritsch-Carlson, so the curve does not overshoot either end
+        delta = end_values - start_values
+        bound = 3 * np.abs(delta)
+        start_tangent = np.where(start_tangent * delta > 0, np.clip(start_tangent, -bound, bound), 0)
+        end_tangent = np.where(end_tangent * delta > 0, np.clip(end_tangent, -bound, bound), 0)
+
+        u2 = u**2
+        u3 = u**3
+        values = (
+            (2 * u3 - 3 * u2 + 1) * start_values
+            + (u3 - 2 * u2 + u) * start_tangent
+            + (-2 * u3 + 3 * u2) * end_values
+            + (u3 - u2) * end_tangent
+        )
+    else:
+        values = start_values + (end_values - start_values) * GAP_EASINGS[easing](u)
+
+    data_lanes[gap_frames, gap_lanes] = values
+    start_confidence = confidence_lanes[start, gap_lanes]
+    end_confidence = confidence_lanes[end, gap_lanes]
+    confidence_lanes[gap_frames, gap_lanes] = start_confidence + (end_confidence - start_confidence) * u[:, 0]
+    return data, confidence
+
+
+def transition_frames(
+    pose1: Pose, frame1: int, pose2: Pose, frame2: int, padding_frames: int, easing="linear", dtype=np.float64
+) -> tuple[np.ndarray, np.ndarray]:
+    """The padding frames "gaps" interpolation fills between `frame1` of `pose1` and `frame2` of `pose2`.
+
+    Only points present in both frames are filled, the others depend on frames further away and are left missing.
+    With the "linear" and "minimum_jerk" easings, these are the exact frames `fill_gaps` computes for the sequence.
+    """
+    data = np.zeros((padding_frames + 2, *pose1.body.data.shape[1:]), dtype=dtype)
+    confidence = np.zeros((padding_frames + 2, *pose1.body.confidence.shape[1:]), dtype=dtype)
+    data[0] = np.asarray(pose1.body.data[frame1])
+    confidence[0] = pose1.body.confidence[frame1]
+    data[-1] = np.asarray(pose2.body.data[frame2])
+    confidence[-1] = pose2.body.confidence[frame2]
+    fill_gaps(data, confidence, easing)
+    return data[1:-1], confidence[1:-1]
+
+
+def concatenate_segments(
+    poses: list[Pose],
+    segments: list[tuple[int, int]],
+    padding_frames: int,
+    interpolation="linear",
+    easing="linear",
+    transitions: list = None,
+    dtype=np.float64,
+) -> Pose:
+    """Concatenates the frames `segments[i]` of every pose, with missing frames of padding between them.
+
+    The `interpolation` "gaps" only fills the missing frames, with `easing`, other kinds re-fit every frame.
+    With "gaps", `transitions` may hold the `transition_frames` of each pair (or None), which are copied instead.
+    The frames are concatenated and interpolated in `dtype`.
+    """
+    first_body = poses[0].body
+    _, people, points, dims = first_body.data.shape
+
+    # Segments are read like slices, one that starts after it ends (when connection points overlap) is empty
+    segments = [slice(start, end).indices(len(pose.body.data))[:2] for pose, (start, end) in zip(poses, segments)]
+    lengths = [max(0, end - start) for start, end in segments]
+
+    # One buffer for the whole sequence, the padding frames are left empty to be interpolated
+    total_frames = sum(lengths) + padding_frames * (len(poses) - 1)
+    data = np.zeros((total_frames, people, points, dims), dtype=dtype)
+    confidence = np.zeros((total_frames, people, points), dtype=dtype)
+
+    offset = 0
+    for pose, (start, end), length in zip(poses, segments, lengths):
+        data[offset : offset + length] = np.asarray(pose.body.data[start:end])
+        confidence[offset : offset + length] = pose.body.confidence[start:end]
+        offset += length + padding_frames
+
+    if interpolation == "gaps" and transitions is not None:
+        offset = 0
+        for i, transition in enumerate(transitions):
+            offset += lengths[i]
+            # Transition frames connect the last frame of a segment to the first of the next, both must exist
+            if transition is not None and lengths[i] > 0 and lengths[i + 1] > 0:
+                transition_data, transition_confidence = transition
+                if len(transition_data) == padding_frames:
+                    data[offset : offset + padding_frames] = transition_data
+                    confidence[offset : offset + padding_frames] = transition_confidence
+            offset += padding_frames
+
+    fps = first_body.fps
+    if interpolation == "gaps":
+        new_data, new_confidence = fill_gaps(data, confidence, easing)
+        new_body = NumPyPoseBody(fps=fps, data=new_data, confidence=new_confidence)
+    elif interpolation == "linear":
+        new_data, new_confidence = interpolate_gaps(data, confidence)
+        new_body = NumPyPoseBody(fps=fps, data=new_data, confidence=new_confidence)
+    else:
+        new_body = NumPyPoseBody(fps=fps, data=data, confidence=confidence).interpolate(kind=interpolation)
+        new_body = NumPyPoseBody(
+            fps=fps, data=new_body.data.astype(dtype), confidence=new_body.confidence.astype(dtype)
+        )
 
     # If a point appears in pose1 and pose3 but not pose2, it will be smoothed in pose2, which is ugly
     # TODO: for every conf, if all of it is 0, update it in the new one
@@ -52,44 +269,146 @@ def concatenate_poses(poses: list[Pose], padding: NumPyPoseBody, interpolation="
     return Pose(header=poses[0].header, body=new_body)
 
 
-def find_best_connection_point(pose1: Pose, pose2: Pose, window=0.3):
+def connection_keypoint_indices(header, keypoints: dict = None) -> np.ndarray:
+    # Point indices of the `keypoints` (component name to point names, or None for all its points) in the header,
+    # `keypoints` may also be its `freeze_points` pairs
+    layout = get_header_layout(header)
+    if keypoints is None:
+        return np.arange(layout.total_points)
+    keypoints = dict(keypoints)
+
+    key = (
+        "connection_keypoints",
+        tuple((name, tuple(points) if points else None) for name, points in keypoints.items()),
+    )
+    return layout.cached(key, lambda: resolve_keypoints(layout, keypoints))
+
+
+def resolve_keypoints(layout: HeaderLayout, keypoints: dict) -> np.ndarray:
+    indices = []
+    for name in layout.component_ranges:
+        if name in keypoints:
+            if keypoints[name]:
+                indices.extend(layout.keypoint_indices(name, keypoints[name]))
+            else:
+                indices.extend(np.flatnonzero(layout.component_mask([name])))
+    if len(indices) == 0:
+        return np.arange(layout.total_points)
+    return np.array(indices)
+
+
+def find_best_connection_points(
+    pairs: list[tuple[Pose, Pose]], window=0.3, keypoints: dict = CONNECTION_KEYPOINTS, confidence_weighted=True
+) -> list[tuple[int, int]]:
+    """For every pair, the frame of the first pose to leave from and the frame of the second to arrive at.
+
+    The closest pair of frames near the end of the first pose and the start of the second is found for all the pairs
+    at once. Only the `keypoints` are compared, and when `confidence_weighted`, each keypoint counts by how confident
+    both frames are about it.
+    """
+    if len(pairs) == 0:
+        return []
+
+    header = pairs[0][0].header
+    indices = connection_keypoint_indices(header, keypoints)
+
     # window size in seconds, or percentage of the pose, whichever is smaller
-    p1_size = math.ceil(min(window * pose1.body.fps, len(pose1.body.data) * window))
-    p2_size = math.ceil(min(window * pose2.body.fps, len(pose2.body.data) * window))
+    sizes = [
+        (
+            math.ceil(min(window * pose1.body.fps, len(pose1.body.data) * window)),
+            math.ceil(min(window * pose2.body.fps, len(pose2.body.data) * window)),
+        )
+        for pose1, pose2 in pairs
+    ]
+    max_size1 = max(size1 for size1, _ in sizes)
+    max_size2 = max(size2 for _, size2 in sizes)
 
-    last_data = pose1.body.data[len(pose1.body.data) - p1_size :]
-    first_data = pose2.body.data[:p2_size]
+    # Windows of all the pairs in one array, padded frames get no confidence and are never chosen
+    people = pairs[0][0].body.data.shape[1]
+    dims = pairs[0][0].body.data.shape[-1]
+    last_data = np.zeros((len(pairs), max_size1, people, len(indices), dims))
+    last_confidence = np.zeros((len(pairs), max_size1, people, len(indices)))
+    first_data = np.zeros((len(pairs), max_size2, people, len(indices), dims))
+    first_confidence = np.zeros((len(pairs), max_size2, people, len(indices)))
+    valid = np.zeros((len(pairs), max_size1, max_size2), dtype=bool)
+    for i, ((pose1, pose2), (size1, size2)) in enumerate(zip(pairs, sizes)):
+        frames1 = len(pose1.body.data)
+        last_data[i, :size1] = np.asarray(pose1.body.data)[frames1 - size1 :, :, indices]
+        last_confidence[i, :size1] = pose1.body.confidence[frames1 - size1 :, :, indices]
+        first_data[i, :size2] = np.asarray(pose2.body.data)[:size2, :, indices]
+        first_confidence[i, :size2] = pose2.body.confidence[:size2, :, indices]
+        valid[i, :size1, :size2] = True
 
-    last_vectors = last_data.reshape(len(last_data), -1)
-    first_vectors = first_data.reshape(len(first_data), -1)
+    squared_distances = ((last_data[:, :, None] - first_data[:, None]) ** 2).sum(axis=-1)
+    squared_distances = squared_distances.reshape(*valid.shape, -1)
+    if confidence_weighted:
+        weights = (last_confidence[:, :, None] * first_confidence[:, None]).reshape(*valid.shape, -1)
+        total_weights = weights.sum(axis=-1)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            distances = np.sqrt((weights * squared_distances).sum(axis=-1) / total_weights)
+        # Pairs without any keypoint both poses are confident about are compared without weights
+        unweighted = ~(valid & (total_weights > 0)).any(axis=(1, 2))
+        distances[unweighted] = np.sqrt(squared_distances[unweighted].sum(axis=-1))
+        distances[~np.isfinite(distances)] = np.inf
+    else:
+        distances = np.sqrt(squared_distances.sum(axis=-1))
+    distances[~valid] = np.inf
 
-    distances_matrix = cdist(last_vectors, first_vectors, "euclidean")
-    min_index = np.unravel_index(np.argmin(distances_matrix, axis=None), distances_matrix.shape)
-    last_index = len(pose1.body.data) - p1_size + min_index[0]
-    return last_index, min_index[1]
+    connection_points = []
+    for i, (pose1, _) in enumerate(pairs):
+        last_index, first_index = np.unravel_index(np.argmin(distances[i]), distances[i].shape)
+        connection_points.append((int(len(pose1.body.data) - sizes[i][0] + last_index), int(first_index)))
+    return connection_points
 
 
-def smooth_concatenate_poses(poses: list[Pose], padding=0.20) -> Pose:
+def find_best_connection_point(
+    pose1: Pose, pose2: Pose, window=0.3, keypoints: dict = CONNECTION_KEYPOINTS, confidence_weighted=True
+):
+    return find_best_connection_points([(pose1, pose2)], window, keypoints, confidence_weighted)[0]
+
+
+def smooth_concatenate_poses(
+    poses: list[Pose],
+    config: PipelineConfig = DEFAULT_CONFIG,
+    connection_points: list[tuple[int, int]] = None,
+    transitions: list = None,
+) -> Pose:
+    # connection_points, if known in advance, hold the result of find_best_connection_point for each adjacent pair
+    # transitions, if known in advance, hold the padding frames of each pair (see `concatenate_segments`)
     if len(poses) == 0:
         raise ValueError("No poses to smooth")
 
     if len(poses) == 1:
         return poses[0]
 
+    if connection_points is None:
+        connection_points = find_best_connection_points(
+            list(zip(poses, poses[1:])),
+            window=config.connection_window,
+            keypoints=config.connection_keypoints,
+            confidence_weighted=config.connection_confidence_weighted,
+        )
+
+    # The frames of each pose to keep, the poses themselves are not modified
+    segments = []
     start = 0
     for i, pose in enumerate(poses):
-        print("Processing", i + 1, "of", len(poses), "...")
         if i != len(poses) - 1:
-            end, next_start = find_best_connection_point(poses[i], poses[i + 1])
+            end, next_start = connection_points[i]
         else:
             end = len(pose.body.data)
             next_start = None
 
-        pose.body = pose.body[start:end]
+        segments.append((start, end))
         start = next_start
 
-    padding_pose = create_padding(padding, poses[0])
-    print("Concatenating...")
-    single_pose = concatenate_poses(poses, padding_pose)
-    print("Smoothing...")
-    return pose_savgol_filter(single_pose)
+    padding_frames = int(config.padding * poses[0].body.fps)
+    compute_dtype, _ = PRECISIONS[config.precision]
+    with span("concatenate", frames=sum(max(0, end - start) for start, end in segments)):
+        single_pose = concatenate_segments(
+            poses, segments, padding_frames, config.interpolation, config.easing, transitions, compute_dtype
+        )
+    with span("smooth"):
+        return pose_savgol_filter(
+            single_pose, config.smoothing_window, config.smoothing_polyorder, config.smoothing_components
+        )
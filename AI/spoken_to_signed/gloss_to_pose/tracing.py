@@ -0,0 +1,127 @@
+import contextvars
+import random
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Callable, NamedTuple, Optional
+
+
+class Span(NamedTuple):
+    """A timed stage of the pipeline, nested in the span it ran in (`parent_id`, None at the top)"""
+
+    name: str
+    span_id: int
+    parent_id: Optional[int]
+    # Nanoseconds since the epoch, measured with a monotonic clock from when the trace started
+    start_time_ns: int
+    end_time_ns: int
+    attributes: dict
+
+    @property
+    def duration(self) -> float:
+        return (self.end_time_ns - self.start_time_ns) / 1e9
+
+
+class Trace:
+    """The spans recorded while the trace is active (see `record`), in the order they ended"""
+
+    def __init__(self):
+        self.spans = []
+        # Wall clock and monotonic clock at the same instant, span times are monotonic offsets from it
+        self.epoch_ns = time.time_ns()
+        self.monotonic_ns = time.perf_counter_ns()
+
+    def now_ns(self) -> int:
+        return self.epoch_ns + time.perf_counter_ns() - self.monotonic_ns
+
+    def durations(self) -> dict:
+        """Seconds spent in every stage, summed over the spans of the same name"""
+        durations = {}
+        for span in self.spans:
+            durations[span.name] = durations.get(span.name, 0.0) + span.duration
+        return {name: round(duration, 6) for name, duration in durations.items()}
+
+    def adopt(self, spans: list[Span], parent_id: Optional[int] = None):
+        # Spans recorded elsewhere (like a worker process), their top spans nested in `parent_id`
+        self.spans.extend(span._replace(parent_id=parent_id) if span.parent_id is None else span for span in spans)
+
+
+_TRACE = contextvars.ContextVar("trace", default=None)
+_SPAN_ID = contextvars.ContextVar("span_id", default=None)
+_NO_SPAN = nullcontext()
+
+
+class _SpanContext:
+    def __init__(self, trace: Trace, name: str, attributes: dict):
+        self.trace = trace
+        self.name = name
+        self.attributes = attributes
+
+    def __enter__(self):
+        self.span_id = random.getrandbits(63)
+        self.parent_id = _SPAN_ID.get()
+        self.token = _SPAN_ID.set(self.span_id)
+        self.start_time_ns = self.trace.now_ns()
+        return self
+
+    def __exit__(self, *exc_info):
+        end_time_ns = self.trace.now_ns()
+        _SPAN_ID.reset(self.token)
+        span = Span(self.name, self.span_id, self.parent_id, self.start_time_ns, end_time_ns, self.attributes)
+        self.trace.spans.append(span)
+
+
+def span(name: str, **attributes):
+    """Times the block as a stage of the active trace, and does nothing (at almost no cost) when none is active"""
+    trace = _TRACE.get()
+    if trace is None:
+        return _NO_SPAN
+    return _SpanContext(trace, name, attributes)
+
+
+def current_trace() -> Optional[Trace]:
+    return _TRACE.get()
+
+
+def current_span_id() -> Optional[int]:
+    return _SPAN_ID.get()
+
+
+@contextmanager
+def record(exporter: Callable[[list[Span]], None] = None):
+    """Records the spans of the block (and of what it runs in the same thread) into a new `Trace`.
+
+    The `exporter`, if given, receives all the spans once the block ends, like `opentelemetry_exporter`.
+    """
+    trace = Trace()
+    trace_token = _TRACE.set(trace)
+    span_token = _SPAN_ID.set(None)
+    try:
+        yield trace
+    finally:
+        _SPAN_ID.reset(span_token)
+        _TRACE.reset(trace_token)
+        if exporter is not None:
+            exporter(trace.spans)
+
+
+def opentelemetry_exporter(name: str = "spoken_to_signed") -> Callable[[list[Span]], None]:
+    """An exporter that replays spans through the OpenTelemetry tracer provider, with their times and nesting"""
+    try:
+        from opentelemetry import trace
+    except ImportError as e:
+        raise ImportError("Please install opentelemetry. pip install opentelemetry-api opentelemetry-sdk") from e
+
+    tracer = trace.get_tracer(name)
+
+    def export(spans: list[Span]):
+        started = {}
+        for span in sorted(spans, key=lambda s: s.start_time_ns):
+            parent = started.get(span.parent_id)
+            context = trace.set_span_in_context(parent) if parent is not None else None
+            started[span.span_id] = tracer.start_span(
+                span.name, context=context, attributes=span.attributes, start_time=span.start_time_ns
+            )
+        for span in spans:
+            started[span.span_id].end(end_time=span.end_time_ns)
+
+    return export
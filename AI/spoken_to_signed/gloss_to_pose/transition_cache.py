@@ -0,0 +1,24 @@
+from typing import NamedTuple, Optional
+
+import numpy as np
+
+from spoken_to_signed.gloss_to_pose.lru_cache import LRUCache
+
+
+class Transition(NamedTuple):
+    """How two lexicon entries connect: the cut points, and the padding frames synthesized between them if known"""
+
+    connection_point: tuple[int, int]
+    data: Optional[np.ndarray] = None
+    confidence: Optional[np.ndarray] = None
+
+
+class TransitionCache(LRUCache):
+    """Transitions between pairs of lexicon entries, kept across requests with least recently used eviction.
+
+    Keys identify both entries (with the version of their files), how they were trimmed, and the settings the
+    transition was computed with, so a changed file or setting never reuses a stale transition.
+    """
+
+    def __init__(self, maxsize=10000):
+        super().__init__(maxsize=maxsize)
@@ -4,31 +4,12 @@ from typing import Iterable
 import numpy as np
 from pose_format import Pose
 
-
-def _resolve_edge_indices(header, component, limb) -> tuple[int, int]:
-    # limb can be indices into component.points or point names
-    a, b = limb
-    if isinstance(a, str) or isinstance(b, str):
-        a_idx = header._get_point_index(component.name, a)
-        b_idx = header._get_point_index(component.name, b)
-        return a_idx, b_idx
-
-    # If indices are small, treat as local component indices; otherwise as global.
-    if max(a, b) < len(component.points):
-        a_idx = header._get_point_index(component.name, component.points[a])
-        b_idx = header._get_point_index(component.name, component.points[b])
-        return a_idx, b_idx
-
-    return int(a), int(b)
+from spoken_to_signed.gloss_to_pose.header_layout import get_header_layout
 
 
 def _iter_edges(header) -> Iterable[tuple[tuple[int, int], str, tuple[int, int, int] | None]]:
-    for component in header.components:
-        for idx, limb in enumerate(component.limbs):
-            color = None
-            if idx < len(component.colors):
-                color = tuple(int(c) for c in component.colors[idx])
-            yield _resolve_edge_indices(header, component, limb), component.name, color
+    layout = get_header_layout(header)
+    yield from zip(map(tuple, layout.edges.tolist()), layout.edge_components, layout.edge_colors)
 
 
 def _get_bounds(points, conf):
@@ -59,13 +40,7 @@ def _color_from_component(color):
 
 
 def _find_point_index(header, names):
-    lowered = {name.lower(): name for name in names}
-    for component in header.components:
-        for i, point in enumerate(component.points):
-            key = point.lower()
-            if key in lowered:
-                return header._get_point_index(component.name, point)
-    return None
+    return get_header_layout(header).find_point(names)
 
 
 def _get_point(frame_points, frame_conf, idx):
@@ -0,0 +1,61 @@
+import csv
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from spoken_to_signed.gloss_to_pose import CSVPoseLookup, gloss_to_pose
+from spoken_to_signed.gloss_to_pose.compile_lexicon import compile_lexicon
+from spoken_to_signed.gloss_to_pose.config import PipelineConfig
+from spoken_to_signed.gloss_to_pose.lookup.fingerspelling_lookup import FingerspellingPoseLookup
+
+LEXICON_DIR = Path(__file__).parents[1] / "spoken_to_signed" / "assets" / "fingerspelling_lexicon"
+
+CONFIGS = [
+    PipelineConfig(),
+    PipelineConfig(is_reduce_holistic=False),
+    PipelineConfig(keypoint_profile="hands_body_face_contour"),
+    PipelineConfig(is_reduce_holistic=False, keypoint_profile="hands_upper_body"),
+]
+
+
+@pytest.fixture(scope="module")
+def compiled_dir(tmp_path_factory):
+    output = tmp_path_factory.mktemp("compiled")
+    compile_lexicon(str(LEXICON_DIR), str(output), workers=2)
+    return output
+
+
+@pytest.fixture(scope="module")
+def backup():
+    return FingerspellingPoseLookup()
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+@pytest.mark.parametrize("glosses", [[("a", "A"), ("b", "B")], [("a", "A"), ("xyz", "XYZ")]], ids=["lexicon", "mixed"])
+def test_compiled_lexicon_matches_source(compiled_dir, backup, config, glosses):
+    source = gloss_to_pose(glosses, CSVPoseLookup(str(LEXICON_DIR), backup=backup), "en", "ase", config=config)
+    compiled = gloss_to_pose(glosses, CSVPoseLookup(str(compiled_dir), backup=backup), "en", "ase", config=config)
+
+    assert [(c.name, c.points) for c in compiled.header.components] == [
+        (c.name, c.points) for c in source.header.components
+    ]
+    assert compiled.body.data.shape == source.body.data.shape
+    # Compiled poses are stored normalized in float32
+    np.testing.assert_allclose(compiled.body.data.filled(0), source.body.data.filled(0), atol=1e-4)
+    np.testing.assert_array_equal(compiled.body.confidence, source.body.confidence)
+
+
+def test_compiled_entry_without_source(compiled_dir):
+    with open(compiled_dir / "index.csv", encoding="utf-8") as f:
+        rows = list(csv.DictReader(f))
+    assert all(row["preprocessed"] == "1" and row["reduced"] == "1" for row in rows)
+
+    for row in rows:
+        row.update(source_path="", source_start="", source_end="")
+    lookup = CSVPoseLookup(str(compiled_dir))
+    lookup.index = lookup.make_index(rows)
+
+    assert lookup.lookup("a", "A", "en", "ase").body.data.shape[2] == 178
+    with pytest.raises(ValueError, match="compiled reduced"):
+        lookup.lookup("a", "A", "en", "ase", config=PipelineConfig(is_reduce_holistic=False))
@@ -0,0 +1,60 @@
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from spoken_to_signed.gloss_to_pose import CSVPoseLookup, gloss_to_pose
+from spoken_to_signed.gloss_to_pose.concatenate import NormalizedPose, prepare_pose
+from spoken_to_signed.gloss_to_pose.config import KEYPOINT_PROFILES, PipelineConfig
+from spoken_to_signed.gloss_to_pose.lookup.fingerspelling_lookup import FingerspellingPoseLookup
+
+LEXICON_DIR = Path(__file__).parents[1] / "spoken_to_signed" / "assets" / "fingerspelling_lexicon"
+
+GLOSSES = [("a", "A"), ("xyz", "XYZ")]
+
+CONFIGS = [
+    PipelineConfig(is_reduce_holistic=is_reduce_holistic, keypoint_profile=profile)
+    for is_reduce_holistic in [True, False]
+    for profile in KEYPOINT_PROFILES
+]
+
+
+@pytest.fixture(scope="module")
+def pose_lookup():
+    return CSVPoseLookup(str(LEXICON_DIR), backup=FingerspellingPoseLookup())
+
+
+def test_fingerspelling_follows_the_call_config(pose_lookup):
+    # "xyz" is spelled by the backup, which prepares its letters with the config of the call
+    full = gloss_to_pose(GLOSSES, pose_lookup, "en", "ase", config=PipelineConfig(is_reduce_holistic=False))
+    reduced = gloss_to_pose(GLOSSES, pose_lookup, "en", "ase", config=PipelineConfig(is_reduce_holistic=True))
+
+    assert full.body.data.shape[2] == full.header.total_points() > reduced.body.data.shape[2]
+    assert reduced.body.data.shape[2] == reduced.header.total_points()
+
+
+def test_fingerspelling_caches_each_config(pose_lookup):
+    config = PipelineConfig(padding=0.1)
+    first = gloss_to_pose(GLOSSES, pose_lookup, "en", "ase", config=config)
+    gloss_to_pose(GLOSSES, pose_lookup, "en", "ase", config=PipelineConfig(padding=0.3))
+    second = gloss_to_pose(GLOSSES, pose_lookup, "en", "ase", config=config)
+
+    np.testing.assert_array_equal(np.ma.getdata(second.body.data), np.ma.getdata(first.body.data))
+    np.testing.assert_array_equal(second.body.confidence, first.body.confidence)
+    assert ("xyz", "en", "ase", config) in pose_lookup.backup.words_cache.cache
+
+
+@pytest.mark.parametrize("config", CONFIGS)
+def test_fingerspelling_returns_prepared_pose(pose_lookup, config):
+    # The spelled word has the points of a lexicon entry prepared with the same config, and is not prepared again
+    spelled = pose_lookup.lookup("xyz", "XYZ", "en", "ase", config=config)
+    entry = prepare_pose(pose_lookup.lookup("a", "A", "en", "ase", config=config), config)
+
+    assert isinstance(spelled, NormalizedPose)
+    assert [(c.name, c.points) for c in spelled.header.components] == [
+        (c.name, c.points) for c in entry.header.components
+    ]
+    assert prepare_pose(spelled, config).header.total_points() == spelled.header.total_points()
+
+    pose = gloss_to_pose(GLOSSES, pose_lookup, "en", "ase", config=config)
+    assert pose.body.data.shape[2] == entry.header.total_points()
@@ -0,0 +1,54 @@
+from pathlib import Path
+
+import pytest
+
+from spoken_to_signed.gloss_to_pose import CSVPoseLookup, gloss_to_pose
+from spoken_to_signed.gloss_to_pose.config import FACE_CONTOUR_POINTS, KEYPOINT_PROFILES, PipelineConfig
+from spoken_to_signed.gloss_to_pose.lookup.fingerspelling_lookup import FingerspellingPoseLookup
+
+LEXICON_DIR = Path(__file__).parents[1] / "spoken_to_signed" / "assets" / "fingerspelling_lexicon"
+
+HANDS = [("LEFT_HAND_LANDMARKS", 21), ("RIGHT_HAND_LANDMARKS", 21)]
+
+# Points of each component, by whether holistic is reduced and by profile
+PROFILE_COMPONENTS = {
+    (True, "full"): [("POSE_LANDMARKS", 8), ("FACE_LANDMARKS", 128), *HANDS],
+    (True, "hands_upper_body"): [("POSE_LANDMARKS", 6), *HANDS],
+    (True, "hands_body_face_contour"): [("POSE_LANDMARKS", 8), ("FACE_LANDMARKS", len(FACE_CONTOUR_POINTS)), *HANDS],
+    (False, "full"): [("POSE_LANDMARKS", 33), ("FACE_LANDMARKS", 478), *HANDS, ("POSE_WORLD_LANDMARKS", 33)],
+    (False, "hands_upper_body"): [("POSE_LANDMARKS", 6), *HANDS],
+    (False, "hands_body_face_contour"): [("POSE_LANDMARKS", 33), ("FACE_LANDMARKS", len(FACE_CONTOUR_POINTS)), *HANDS],
+}
+
+
+@pytest.fixture(scope="module")
+def pose_lookup():
+    return CSVPoseLookup(str(LEXICON_DIR), backup=FingerspellingPoseLookup())
+
+
+def test_every_profile_is_tested():
+    assert {profile for _, profile in PROFILE_COMPONENTS} == set(KEYPOINT_PROFILES)
+
+
+@pytest.mark.parametrize(("is_reduce_holistic", "profile"), PROFILE_COMPONENTS)
+@pytest.mark.parametrize(
+    "glosses",
+    [[("a", "A")], [("xyz", "XYZ")], [("a", "A"), ("xyz", "XYZ")]],
+    ids=["lexicon", "fingerspelled", "both"],
+)
+def test_profile_components(pose_lookup, glosses, is_reduce_holistic, profile):
+    config = PipelineConfig(is_reduce_holistic=is_reduce_holistic, keypoint_profile=profile)
+    pose = gloss_to_pose(glosses, pose_lookup, "en", "ase", config=config)
+
+    components = PROFILE_COMPONENTS[(is_reduce_holistic, profile)]
+    assert [(c.name, len(c.points)) for c in pose.header.components] == components
+    assert pose.body.data.shape[2] == pose.body.confidence.shape[2] == sum(points for _, points in components)
+
+
+def test_profile_keeps_named_points(pose_lookup):
+    config = PipelineConfig(keypoint_profile="hands_body_face_contour")
+    pose = gloss_to_pose([("a", "A"), ("xyz", "XYZ")], pose_lookup, "en", "ase", config=config)
+
+    [face] = [c for c in pose.header.components if c.name == "FACE_LANDMARKS"]
+    assert sorted(face.points, key=int) == sorted(FACE_CONTOUR_POINTS, key=int)
+    assert all(a < len(face.points) and b < len(face.points) for a, b in face.limbs)
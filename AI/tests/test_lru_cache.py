@@ -0,0 +1,35 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from spoken_to_signed.gloss_to_pose.lru_cache import LRUCache
+from spoken_to_signed.gloss_to_pose.transition_cache import TransitionCache
+
+
+def test_evicts_least_recently_used():
+    cache = LRUCache(maxsize=2)
+    cache.set("a", 1)
+    cache.set("b", 2)
+    assert cache.get("a") == 1
+    cache.set("c", 3)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == 1
+    assert cache.get("c") == 3
+    assert cache.stats() == {"size": 2, "maxsize": 2, "hits": 3, "misses": 1, "hit_rate": 0.75}
+
+
+def test_concurrent_get_and_set():
+    # Sets evict keys while other threads read them
+    cache = TransitionCache(maxsize=2)
+
+    def use(thread: int):
+        for i in range(2000):
+            key = (thread + i) % 3
+            if cache.get(key) is None:
+                cache.set(key, i)
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(use, range(8)))
+
+    stats = cache.stats()
+    assert stats["size"] == 2
+    assert stats["hits"] + stats["misses"] == 8 * 2000
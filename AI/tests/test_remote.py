@@ -0,0 +1,177 @@
+import os
+import threading
+from functools import partial
+from http.server import SimpleHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+
+import numpy as np
+import pytest
+from pose_format import Pose
+from pose_format.numpy import NumPyPoseBody
+
+from spoken_to_signed.gloss_to_pose.build_index import scan_pose_file
+from spoken_to_signed.gloss_to_pose.lookup.remote import DiskCache, RemotePoseFetcher, frame_range
+
+LEXICON_DIR = Path(__file__).parents[1] / "spoken_to_signed" / "assets" / "fingerspelling_lexicon" / "ase"
+
+
+class RangeRequestHandler(SimpleHTTPRequestHandler):
+    """Serves files with single byte ranges, recording the bytes sent for every request"""
+
+    supports_range = True
+    downloads = None
+
+    def send_head(self):
+        path = self.translate_path(self.path)
+        if not os.path.isfile(path):
+            self.send_error(404)
+            return None
+        with open(path, "rb") as f:
+            data = f.read()
+
+        start, end = 0, len(data) - 1
+        range_header = self.headers.get("Range")
+        if self.supports_range and range_header is not None:
+            first, last = range_header.removeprefix("bytes=").split("-")
+            start = int(first)
+            end = min(int(last), len(data) - 1) if last else len(data) - 1
+            if start >= len(data):
+                self.send_error(416)
+                return None
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{end}/{len(data)}")
+        else:
+            self.send_response(200)
+
+        body = data[start : end + 1]
+        self.downloads.append((start, len(body)))
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        return None
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def pose_path(tmp_path):
+    # A long pose, so that a slice of it is much smaller than the file
+    with open(next(LEXICON_DIR.glob("*.pose")), "rb") as f:
+        pose = Pose.read(f.read())
+    repeats = -(-300 // len(pose.body.data))
+    data = np.concatenate([pose.body.data.filled(0)] * repeats)[:300]
+    confidence = np.concatenate([pose.body.confidence] * repeats)[:300]
+    pose = Pose(pose.header, NumPyPoseBody(pose.body.fps, data, confidence))
+
+    path = tmp_path / "long.pose"
+    with open(path, "wb") as f:
+        pose.write(f)
+    return path
+
+
+def serve(directory: Path, supports_range: bool):
+    downloads = []
+    handler = type("Handler", (RangeRequestHandler,), {"supports_range": supports_range, "downloads": downloads})
+    server = ThreadingHTTPServer(("127.0.0.1", 0), partial(handler, directory=str(directory)))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, downloads
+
+
+@pytest.fixture
+def range_server(pose_path):
+    server, downloads = serve(pose_path.parent, supports_range=True)
+    yield f"http://127.0.0.1:{server.server_port}/{pose_path.name}", downloads
+    server.shutdown()
+
+
+@pytest.fixture
+def full_server(pose_path):
+    server, downloads = serve(pose_path.parent, supports_range=False)
+    yield f"http://127.0.0.1:{server.server_port}/{pose_path.name}", downloads
+    server.shutdown()
+
+
+def local_slice(pose_path: Path, start: int, end: int) -> Pose:
+    with open(pose_path, "rb") as f:
+        pose = Pose.read(f.read())
+    start_frame, end_frame = frame_range(pose.body.fps, start, end)
+    return Pose(pose.header, pose.body[start_frame:end_frame])
+
+
+def assert_same_pose(pose: Pose, expected: Pose):
+    assert pose.body.data.shape == expected.body.data.shape
+    np.testing.assert_array_equal(pose.body.data.filled(0), expected.body.data.filled(0))
+    np.testing.assert_array_equal(pose.body.confidence, expected.body.confidence)
+
+
+@pytest.mark.parametrize(("start", "end"), [(2000, 3000), (0, 500), (9000, 0)])
+def test_read_pose_matches_local_slice(pose_path, range_server, start, end):
+    url, _ = range_server
+    pose = RemotePoseFetcher().read_pose(url, start, end)
+    assert_same_pose(pose, local_slice(pose_path, start, end))
+
+
+def test_read_pose_downloads_header_and_frames_only(pose_path, range_server):
+    url, downloads = range_server
+    fetcher = RemotePoseFetcher()
+    fetcher.read_pose(url, 4000, 4500)
+
+    info = scan_pose_file(str(pose_path))
+    start_frame, end_frame = frame_range(info["fps"], 4000, 4500)
+    frame_points = info["people"] * info["points"]
+    data_size = info["frames"] * frame_points * info["dims"] * 4
+    wanted = [
+        (0, info["data_offset"]),
+        (
+            info["data_offset"] + start_frame * frame_points * info["dims"] * 4,
+            info["data_offset"] + end_frame * frame_points * info["dims"] * 4,
+        ),
+        (
+            info["data_offset"] + data_size + start_frame * frame_points * 4,
+            info["data_offset"] + data_size + end_frame * frame_points * 4,
+        ),
+    ]
+
+    # Every download starts in the header or in the requested frames, and reads at most a request size past them
+    min_request_size = 64 * 1024
+    for offset, length in downloads:
+        assert any(first <= offset < last for first, last in wanted), (offset, length)
+    assert sum(length for _, length in downloads) <= sum(last - first for first, last in wanted) + 3 * min_request_size
+    assert sum(length for _, length in downloads) < info["size"] / 4
+
+
+def test_read_pose_without_range_support(pose_path, full_server):
+    url, downloads = full_server
+    pose = RemotePoseFetcher().read_pose(url, 2000, 3000)
+    assert_same_pose(pose, local_slice(pose_path, 2000, 3000))
+    # The whole file was sent once, and every later read is served from it
+    assert downloads == [(0, os.path.getsize(pose_path))]
+
+
+def test_read_pose_disk_cache(tmp_path, pose_path, range_server):
+    url, downloads = range_server
+    fetcher = RemotePoseFetcher(cache_directory=str(tmp_path / "cache"))
+    first = fetcher.read_pose(url, 2000, 3000)
+    downloaded = len(downloads)
+
+    second = fetcher.read_pose(url, 2000, 3000)
+    assert len(downloads) == downloaded
+    assert_same_pose(second, first)
+
+
+def test_disk_cache_evicts_least_recently_used(tmp_path):
+    cache = DiskCache(str(tmp_path), max_bytes=25)
+    cache.set("a", b"a" * 10)
+    cache.set("b", b"b" * 10)
+    os.utime(cache.path("a"), (1, 1))
+    os.utime(cache.path("b"), (2, 2))
+
+    # Reading "a" makes "b" the least recently used
+    assert cache.get("a") == b"a" * 10
+    cache.set("c", b"c" * 10)
+
+    assert cache.get("b") is None
+    assert cache.get("a") == b"a" * 10
+    assert cache.get("c") == b"c" * 10
+    assert cache.total_bytes == 20
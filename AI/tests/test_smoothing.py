@@ -0,0 +1,146 @@
+import time
+from pathlib import Path
+
+import numpy as np
+import pytest
+import scipy.signal
+from pose_format import Pose
+from pose_format.numpy import NumPyPoseBody
+from pose_format.utils.generic import reduce_holistic
+
+from spoken_to_signed.gloss_to_pose.smoothing import concatenate_segments, pose_savgol_filter
+
+LEXICON_DIR = Path(__file__).parents[1] / "spoken_to_signed" / "assets" / "fingerspelling_lexicon" / "ase"
+
+
+def legacy_savgol_filter(pose: Pose) -> Pose:
+    # The filter as it was, one call per point and dimension, skipping the face but for its last point
+    [face_component] = [c for c in pose.header.components if c.name == "FACE_LANDMARKS"]
+    face_range = range(
+        pose.header._get_point_index("FACE_LANDMARKS", face_component.points[0]),
+        pose.header._get_point_index("FACE_LANDMARKS", face_component.points[-1]),
+    )
+
+    _, _, points, dims = pose.body.data.shape
+    for p in range(points):
+        if p not in face_range:
+            for d in range(dims):
+                pose.body.data[:, 0, p, d] = scipy.signal.savgol_filter(pose.body.data[:, 0, p, d], 3, 1)
+    return pose
+
+
+def concatenated_pose(frames: int, reduce: bool = True, dtype=np.float64, seed: int = 0) -> Pose:
+    """Lexicon poses one after the other, with some points missing (masked, at zero confidence) at random"""
+    poses = []
+    for path in sorted(LEXICON_DIR.glob("*.pose")):
+        with open(path, "rb") as f:
+            pose = Pose.read(f.read())
+        poses.append(reduce_holistic(pose) if reduce else pose)
+
+    bodies = [pose.body for pose in poses]
+    repeats = -(-frames // sum(len(body.data) for body in bodies))
+    data = np.concatenate([body.data.filled(0) for body in bodies] * repeats)[:frames].astype(dtype)
+    confidence = np.concatenate([body.confidence for body in bodies] * repeats)[:frames]
+
+    missing = np.random.default_rng(seed).random(confidence.shape) < 0.1
+    confidence[missing] = 0
+    return Pose(poses[0].header, NumPyPoseBody(poses[0].body.fps, data, confidence))
+
+
+def copy_pose(pose: Pose) -> Pose:
+    body = NumPyPoseBody(pose.body.fps, pose.body.data.copy(), pose.body.confidence.copy())
+    return Pose(pose.header, body)
+
+
+@pytest.mark.parametrize("reduce", [True, False])
+def test_savgol_filter_matches_per_point_loop(reduce):
+    pose = concatenated_pose(300, reduce=reduce)
+    assert np.ma.getmaskarray(pose.body.data).any()
+
+    expected = legacy_savgol_filter(copy_pose(pose))
+    smoothed = pose_savgol_filter(copy_pose(pose))
+
+    np.testing.assert_array_equal(np.ma.getmaskarray(smoothed.body.data), np.ma.getmaskarray(expected.body.data))
+    np.testing.assert_array_equal(np.ma.getdata(smoothed.body.data), np.ma.getdata(expected.body.data))
+    np.testing.assert_array_equal(smoothed.body.confidence, expected.body.confidence)
+
+
+def test_savgol_filter_float32_matches_per_point_loop():
+    # The edges are fitted in float32 over all the points at once, which rounds them a little differently
+    pose = concatenated_pose(300, dtype=np.float32)
+    expected = legacy_savgol_filter(copy_pose(pose))
+    smoothed = pose_savgol_filter(copy_pose(pose))
+
+    np.testing.assert_array_equal(np.ma.getmaskarray(smoothed.body.data), np.ma.getmaskarray(expected.body.data))
+    np.testing.assert_allclose(np.ma.getdata(smoothed.body.data), np.ma.getdata(expected.body.data), rtol=1e-6)
+
+
+def test_savgol_filter_component_settings():
+    pose = concatenated_pose(120)
+    original = np.ma.getdata(pose.body.data).copy()
+    smoothed = pose_savgol_filter(copy_pose(pose), 5, 2, {"FACE_LANDMARKS": (7, 3), "LEFT_HAND_LANDMARKS": None})
+
+    def points(name: str) -> range:
+        component = next(c for c in pose.header.components if c.name == name)
+        start = pose.header._get_point_index(name, component.points[0])
+        return range(start, start + len(component.points))
+
+    data = np.ma.getdata(smoothed.body.data)
+    face, left_hand = points("FACE_LANDMARKS"), points("LEFT_HAND_LANDMARKS")
+    right_hand = points("RIGHT_HAND_LANDMARKS")
+    # Overrides apply to every point of the component, the last one included
+    for p, (window, order) in [(face[0], (7, 3)), (face[-1], (7, 3)), (right_hand[-1], (5, 2))]:
+        np.testing.assert_allclose(data[:, 0, p], scipy.signal.savgol_filter(original[:, 0, p], window, order, axis=0))
+    for p in [left_hand[0], left_hand[-1]]:
+        np.testing.assert_array_equal(data[:, 0, p], original[:, 0, p])
+
+
+def test_savgol_filter_default_skips_the_face_but_its_last_point():
+    pose = concatenated_pose(120)
+    original = np.ma.getdata(pose.body.data).copy()
+    data = np.ma.getdata(pose_savgol_filter(copy_pose(pose)).body.data)
+
+    face = next(c for c in pose.header.components if c.name == "FACE_LANDMARKS")
+    first = pose.header._get_point_index("FACE_LANDMARKS", face.points[0])
+    last = first + len(face.points) - 1
+    np.testing.assert_array_equal(data[:, 0, first:last], original[:, 0, first:last])
+    np.testing.assert_allclose(data[:, 0, last], scipy.signal.savgol_filter(original[:, 0, last], 3, 1, axis=0))
+
+
+@pytest.mark.parametrize("interpolation", ["linear", "gaps"])
+def test_concatenate_segments_overlapping_connection_points(interpolation):
+    # The second connection starts before the first ends, so nothing of the second pose is kept
+    pose = concatenated_pose(73)
+    poses = [Pose(pose.header, pose.body[start:end]) for start, end in [(0, 24), (24, 48), (48, 73)]]
+    padding_frames = 5
+    transitions = [None, None] if interpolation == "gaps" else None
+
+    overlapping = concatenate_segments(
+        poses, [(0, 23), (15, 5), (0, 25)], padding_frames, interpolation, "linear", transitions
+    )
+    empty = concatenate_segments(
+        poses, [(0, 23), (0, 0), (0, 25)], padding_frames, interpolation, "linear", transitions
+    )
+
+    assert len(overlapping.body.data) == 23 + 0 + 25 + 2 * padding_frames
+    np.testing.assert_array_equal(np.ma.getdata(overlapping.body.data), np.ma.getdata(empty.body.data))
+    np.testing.assert_array_equal(overlapping.body.confidence, empty.body.confidence)
+
+
+@pytest.mark.slow
+def test_savgol_filter_benchmark():
+    pose = concatenated_pose(2500)
+
+    def best_time(function, repeat=3) -> float:
+        times = []
+        for _ in range(repeat):
+            copy = copy_pose(pose)
+            started = time.perf_counter()
+            function(copy)
+            times.append(time.perf_counter() - started)
+        return min(times)
+
+    legacy = best_time(legacy_savgol_filter)
+    grouped = best_time(pose_savgol_filter)
+    print(f"savgol filter of {pose.body.data.shape}: {legacy * 1000:.1f}ms per point, {grouped * 1000:.1f}ms grouped")
+    assert grouped < legacy / 2
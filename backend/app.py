@@ -11,13 +11,18 @@ import uuid
 import urllib.parse
 import urllib.request
 import io
+import json
+import hmac
+from collections import Counter
+from contextlib import nullcontext
 from pathlib import Path
 from typing import Optional
 
 import numpy as np
 from PIL import Image
-from fastapi import BackgroundTasks, FastAPI, File, Form, HTTPException, UploadFile
+from fastapi import BackgroundTasks, FastAPI, File, Form, Header, HTTPException, UploadFile
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse
 from fastapi.staticfiles import StaticFiles
 
 ROOT_DIR = Path(__file__).resolve().parents[1]
@@ -26,8 +31,16 @@ if str(AI_DIR) not in sys.path:
     sys.path.insert(0, str(AI_DIR))
 
 from pose_format import Pose
-from spoken_to_signed.gloss_to_pose import CSVPoseLookup, concatenate_poses, gloss_to_pose
+from spoken_to_signed.gloss_to_pose import glosses_to_pose
+from spoken_to_signed.gloss_to_pose.config import KEYPOINT_PROFILES, PipelineConfig
+from spoken_to_signed.gloss_to_pose.header_layout import get_header_layout
+from spoken_to_signed.gloss_to_pose.lookup.executor import LookupExecutor
 from spoken_to_signed.gloss_to_pose.lookup.fingerspelling_lookup import FingerspellingPoseLookup
+from spoken_to_signed.gloss_to_pose.lookup.lexicon_manager import LexiconManager
+from spoken_to_signed.gloss_to_pose.lookup.remote import RemotePoseFetcher
+from spoken_to_signed.gloss_to_pose.process_pool import GlossToPoseProcessPool
+from spoken_to_signed.gloss_to_pose.tracing import opentelemetry_exporter, record, span
+from spoken_to_signed.gloss_to_pose.transition_cache import TransitionCache
 from spoken_to_signed.skeleton_video import pose_to_skeleton_video
 
 RUNS_DIR = Path(__file__).resolve().parent / "runs"
@@ -35,6 +48,26 @@ RUNS_DIR.mkdir(parents=True, exist_ok=True)
 
 DEFAULT_LEXICON = (AI_DIR / "assets" / "dummy_lexicon").resolve()
 DEFAULT_MAX_YOUTUBE_DURATION_SEC = int(os.environ.get("MAX_YOUTUBE_DURATION_SEC", "1200"))
+POSE_CACHE_DIR = os.environ.get("POSE_CACHE_DIR") or None
+POSE_CACHE_MAX_MB = int(os.environ.get("POSE_CACHE_MAX_MB", "512"))
+LOOKUP_FREQUENCY_PATH = Path(
+    os.environ.get("LOOKUP_FREQUENCY_PATH", str(Path(__file__).resolve().parent / "lookup_frequency.json"))
+)
+WARMUP_TOP_N = int(os.environ.get("WARMUP_TOP_N", "100"))
+LOOKUP_FREQUENCY_FLUSH_SEC = float(os.environ.get("LOOKUP_FREQUENCY_FLUSH_SEC", "30"))
+LOOKUP_FREQUENCY_MAX_ENTRIES = int(os.environ.get("LOOKUP_FREQUENCY_MAX_ENTRIES", "10000"))
+LEXICON_POLL_INTERVAL_SEC = float(os.environ.get("LEXICON_POLL_INTERVAL_SEC", "5"))
+LOOKUP_WORKERS = int(os.environ.get("LOOKUP_WORKERS", "16"))
+LOOKUP_WORKERS_PER_JOB = int(os.environ.get("LOOKUP_WORKERS_PER_JOB", "8"))
+TRANSITION_CACHE_SIZE = int(os.environ.get("TRANSITION_CACHE_SIZE", "10000"))
+GLOSS_TO_POSE_PROCESSES = int(os.environ.get("GLOSS_TO_POSE_PROCESSES", "0"))
+TRACE_OPENTELEMETRY = os.environ.get("TRACE_OPENTELEMETRY", "0") == "1"
+# Jobs can only be profiled by requests with this token, and not at all when it is unset
+ADMIN_TOKEN = os.environ.get("ADMIN_TOKEN") or None
+PROFILE_INTERVAL_SEC = float(os.environ.get("PROFILE_INTERVAL_MS", "5")) / 1000
+
+# Every job runs with this configuration, but for what the request chooses (like its keypoint profile)
+PIPELINE_CONFIG = PipelineConfig()
 
 ALLOWED_GLOSSERS = {"simple", "spacylemma", "rules"}
 ALLOWED_MODES = {"text", "audio", "video", "youtube"}
@@ -102,6 +135,125 @@ def _set_progress(job_id: str, progress: int):
     _update_job(job_id, progress=max(0, min(100, int(progress))))
 
 
+# Histogram buckets of seconds, frames per second and batch sizes
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+FPS_BUCKETS = (1, 5, 10, 15, 24, 30, 60, 120, 240)
+BATCH_SIZE_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+# Every metric of /metrics, by name: its type, help and histogram buckets
+_METRICS = {
+    "spoken_jobs": ("gauge", "Jobs by status, queued jobs waiting for a worker", None),
+    "spoken_jobs_total": ("counter", "Jobs that ended, by mode and status", None),
+    "spoken_job_duration_seconds": ("histogram", "Seconds from the start to the end of a job, by mode", SECONDS_BUCKETS),
+    "spoken_job_stage_seconds": ("histogram", "Seconds spent in each stage of a job", SECONDS_BUCKETS),
+    "spoken_lexicon_requests_total": ("counter", "Lexicons requested by jobs, by whether already loaded", None),
+    "spoken_pose_cache_requests_total": ("counter", "Pose cache lookups of each lexicon, by result", None),
+    "spoken_pose_cache_entries": ("gauge", "Poses cached for each lexicon", None),
+    "spoken_transition_cache_requests_total": ("counter", "Transition cache lookups, by result", None),
+    "spoken_transition_cache_entries": ("gauge", "Transitions cached", None),
+    "spoken_lookup_tasks_total": ("counter", "Lexicon entries loaded by the lookup threads", None),
+    "spoken_lookup_running": ("gauge", "Lexicon entries being loaded", None),
+    "spoken_lookup_wait_seconds_total": ("counter", "Seconds lookups waited for a thread", None),
+    "spoken_lookup_load_seconds_total": ("counter", "Seconds lookups spent loading", None),
+    "spoken_model_load_seconds": ("histogram", "Seconds to load each model", SECONDS_BUCKETS),
+    "spoken_recognize_batch_size": ("histogram", "Images per recognition", BATCH_SIZE_BUCKETS),
+    "spoken_recognize_seconds": ("histogram", "Seconds of model inference per recognition", SECONDS_BUCKETS),
+    "spoken_render_fps": ("histogram", "Frames rendered per second of each video", FPS_BUCKETS),
+    "spoken_render_frames_total": ("counter", "Frames rendered", None),
+}
+# Values of the counters and histograms, by metric name and labels
+_METRIC_VALUES = {}
+_METRICS_LOCK = threading.Lock()
+
+
+def _inc(name: str, value: float = 1, **labels):
+    key = (name, tuple(sorted(labels.items())))
+    with _METRICS_LOCK:
+        _METRIC_VALUES[key] = _METRIC_VALUES.get(key, 0) + value
+
+
+def _observe(name: str, value: float, **labels):
+    buckets = _METRICS[name][2]
+    key = (name, tuple(sorted(labels.items())))
+    with _METRICS_LOCK:
+        histogram = _METRIC_VALUES.get(key)
+        if histogram is None:
+            histogram = _METRIC_VALUES[key] = {"buckets": [0] * len(buckets), "sum": 0.0, "count": 0}
+        # Buckets are cumulative, a value counts in every bucket it is at most the bound of
+        for i, bound in enumerate(buckets):
+            if value <= bound:
+                histogram["buckets"][i] += 1
+        histogram["sum"] += value
+        histogram["count"] += 1
+
+
+def _format_labels(labels) -> str:
+    if not labels:
+        return ""
+    escaped = [
+        (key, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")) for key, value in labels
+    ]
+    return "{" + ",".join(f'{key}="{value}"' for key, value in escaped) + "}"
+
+
+def _scrape_metrics() -> list:
+    # (name, labels, value) of the metrics read from the jobs and caches when scraped
+    samples = []
+    with JOBS_LOCK:
+        statuses = Counter(job["status"] for job in JOBS.values())
+    for status in ["queued", "running", "completed", "failed"]:
+        samples.append(("spoken_jobs", (("status", status),), statuses.get(status, 0)))
+
+    with _POSE_LOOKUP_LOCK:
+        managers = dict(_POSE_LOOKUP_CACHE)
+    for lexicon_key, manager in managers.items():
+        stats = manager.lookup.cache.stats()
+        for result, count in [("hit", stats["hits"]), ("miss", stats["misses"])]:
+            labels = (("lexicon", lexicon_key), ("result", result))
+            samples.append(("spoken_pose_cache_requests_total", labels, count))
+        samples.append(("spoken_pose_cache_entries", (("lexicon", lexicon_key),), stats["size"]))
+
+    if _TRANSITION_CACHE is not None:
+        stats = _TRANSITION_CACHE.stats()
+        samples.append(("spoken_transition_cache_requests_total", (("result", "hit"),), stats["hits"]))
+        samples.append(("spoken_transition_cache_requests_total", (("result", "miss"),), stats["misses"]))
+        samples.append(("spoken_transition_cache_entries", (), stats["size"]))
+
+    with _LOOKUP_EXECUTOR.lock:
+        samples.append(("spoken_lookup_tasks_total", (), _LOOKUP_EXECUTOR.tasks))
+        samples.append(("spoken_lookup_running", (), _LOOKUP_EXECUTOR.running))
+        samples.append(("spoken_lookup_wait_seconds_total", (), _LOOKUP_EXECUTOR.wait_seconds))
+        samples.append(("spoken_lookup_load_seconds_total", (), _LOOKUP_EXECUTOR.load_seconds))
+    return samples
+
+
+def _render_metrics() -> str:
+    """Every metric in the Prometheus text format"""
+    samples = {}
+    for name, labels, value in _scrape_metrics():
+        samples.setdefault(name, []).append((labels, value))
+    with _METRICS_LOCK:
+        for (name, labels), value in _METRIC_VALUES.items():
+            if isinstance(value, dict):
+                value = {**value, "buckets": list(value["buckets"])}
+            samples.setdefault(name, []).append((labels, value))
+
+    lines = []
+    for name, (metric_type, help_text, buckets) in _METRICS.items():
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for labels, value in samples.get(name, []):
+            if metric_type != "histogram":
+                lines.append(f"{name}{_format_labels(labels)} {value}")
+                continue
+            for bound, count in zip(buckets, value["buckets"]):
+                lines.append(f"{name}_bucket{_format_labels(labels + (('le', str(bound)),))} {count}")
+            lines.append(f"{name}_bucket{_format_labels(labels + (('le', '+Inf'),))} {value['count']}")
+            lines.append(f"{name}_sum{_format_labels(labels)} {value['sum']}")
+            lines.append(f"{name}_count{_format_labels(labels)} {value['count']}")
+    return "\n".join(lines) + "\n"
+
+
 def _get_ffmpeg_path():
     try:
         from imageio_ffmpeg import get_ffmpeg_exe
@@ -119,29 +271,9 @@ def _get_class_names():
     return parts or DEFAULT_CLASS_NAMES
 
 
-def _resolve_edge_indices(header, component, limb) -> tuple[int, int]:
-    a, b = limb
-    if isinstance(a, str) or isinstance(b, str):
-        a_idx = header._get_point_index(component.name, a)
-        b_idx = header._get_point_index(component.name, b)
-        return a_idx, b_idx
-
-    if max(a, b) < len(component.points):
-        a_idx = header._get_point_index(component.name, component.points[a])
-        b_idx = header._get_point_index(component.name, component.points[b])
-        return a_idx, b_idx
-
-    return int(a), int(b)
-
-
 def _pose_edges(pose: Pose) -> list[list[int]]:
-    edges = []
-    header = pose.header
-    for component in header.components:
-        for limb in component.limbs:
-            a_idx, b_idx = _resolve_edge_indices(header, component, limb)
-            edges.append([int(a_idx), int(b_idx)])
-    return edges
+    # Resolved once per header layout
+    return get_header_layout(pose.header).edges.tolist()
 
 
 def _sanitize_float(value: float) -> float:
@@ -202,7 +334,9 @@ def _get_model():
                     ) from exc
                 if not MODEL_PATH.exists():
                     raise RuntimeError(f"Model not found: {MODEL_PATH}")
+                started = time.perf_counter()
                 _MODEL = tf.keras.models.load_model(str(MODEL_PATH))
+                _observe("spoken_model_load_seconds", time.perf_counter() - started, model="asl")
     return _MODEL
 
 
@@ -243,7 +377,9 @@ def _get_whisper_model():
                         "Missing dependency: openai-whisper. Install it in backend/requirements.txt."
                     ) from exc
                 model_name = os.environ.get("WHISPER_MODEL", "base")
+                started = time.perf_counter()
                 _WHISPER_MODEL = whisper.load_model(model_name)
+                _observe("spoken_model_load_seconds", time.perf_counter() - started, model=f"whisper-{model_name}")
     return _WHISPER_MODEL
 
 
@@ -266,12 +402,18 @@ def _text_to_gloss(text: str, language: str, glosser: str, signed_language: str)
     return module.text_to_gloss(text=text, language=language, signed_language=signed_language)
 
 
-def _gloss_to_pose(sentences, lexicon: Path, spoken_language: str, signed_language: str):
+def _gloss_to_pose(sentences, lexicon: Path, spoken_language: str, signed_language: str, config: PipelineConfig):
+    if _GLOSS_TO_POSE_POOL is not None:
+        _record_lookups(lexicon, sentences, spoken_language, signed_language)
+        return _GLOSS_TO_POSE_POOL.glosses_to_pose(
+            sentences, str(lexicon.resolve()), spoken_language, signed_language, config
+        )
+
     lookup = _get_pose_lookup(lexicon)
-    poses = [gloss_to_pose(gloss, lookup, spoken_language, signed_language) for gloss in sentences]
-    if len(poses) == 1:
-        return poses[0]
-    return concatenate_poses(poses, trim=False)
+    _record_lookups(lexicon, sentences, spoken_language, signed_language)
+    return glosses_to_pose(
+        sentences, lookup, spoken_language, signed_language, config=config, transition_cache=_TRANSITION_CACHE
+    )
 
 
 def _glosses_to_string(sentences):
@@ -284,18 +426,166 @@ def _glosses_to_string(sentences):
 
 _POSE_LOOKUP_CACHE = {}
 _POSE_LOOKUP_LOCK = threading.Lock()
+_POSE_FETCHER = RemotePoseFetcher(cache_directory=POSE_CACHE_DIR, cache_max_bytes=POSE_CACHE_MAX_MB * 1024 * 1024)
+# Lookups of every job and warm-up share these threads
+_LOOKUP_EXECUTOR = LookupExecutor(max_workers=LOOKUP_WORKERS, per_call=LOOKUP_WORKERS_PER_JOB)
+# Pairs of signs that were already connected are reused by every later request
+_TRANSITION_CACHE = TransitionCache(maxsize=TRANSITION_CACHE_SIZE) if TRANSITION_CACHE_SIZE > 0 else None
+# Spans of every job are replayed to OpenTelemetry when enabled, they are timed either way
+_TRACE_EXPORTER = opentelemetry_exporter() if TRACE_OPENTELEMETRY else None
 
 
 def _get_pose_lookup(lexicon: Path):
+    # Each lexicon is managed for hot-reload, the lookup object stays the same while its index is swapped
     lexicon_key = str(lexicon.resolve())
     with _POSE_LOOKUP_LOCK:
         cached = _POSE_LOOKUP_CACHE.get(lexicon_key)
         if cached is not None:
-            return cached
+            _inc("spoken_lexicon_requests_total", result="loaded")
+            return cached.lookup
+        _inc("spoken_lexicon_requests_total", result="new")
         fingerspelling = FingerspellingPoseLookup()
-        lookup = CSVPoseLookup(str(lexicon), backup=fingerspelling)
-        _POSE_LOOKUP_CACHE[lexicon_key] = lookup
-        return lookup
+        manager = LexiconManager(
+            str(lexicon),
+            backup=fingerspelling,
+            fetcher=_POSE_FETCHER,
+            executor=_LOOKUP_EXECUTOR,
+            poll_interval=LEXICON_POLL_INTERVAL_SEC,
+            on_reload=lambda lookup: _start_warm_up(lexicon_key, lookup, restart=True),
+        )
+        if LEXICON_POLL_INTERVAL_SEC > 0:
+            manager.start()
+        _POSE_LOOKUP_CACHE[lexicon_key] = manager
+    _start_warm_up(lexicon_key, manager.lookup)
+    return manager.lookup
+
+
+def _load_lookup_frequency() -> Counter:
+    if not LOOKUP_FREQUENCY_PATH.exists():
+        return Counter()
+    try:
+        with open(LOOKUP_FREQUENCY_PATH, encoding="utf-8") as f:
+            entries = json.load(f)
+    except (OSError, ValueError):
+        traceback.print_exc()
+        return Counter()
+    return Counter(
+        {
+            (e["lexicon"], e["spoken_language"], e["signed_language"], e["word"], e["gloss"]): e["count"]
+            for e in entries
+        }
+    )
+
+
+_LOOKUP_FREQUENCY = _load_lookup_frequency()
+_LOOKUP_FREQUENCY_LOCK = threading.Lock()
+# Set when the counts changed since they were last written, writes themselves do not overlap
+_LOOKUP_FREQUENCY_DIRTY = threading.Event()
+_LOOKUP_FREQUENCY_WRITE_LOCK = threading.Lock()
+
+
+def _record_lookups(lexicon: Path, sentences, spoken_language: str, signed_language: str):
+    # Only counted in memory, the counts are written to disk in the background by `_flush_lookup_frequency`
+    lexicon_key = str(lexicon.resolve())
+    with _LOOKUP_FREQUENCY_LOCK:
+        for sentence in sentences:
+            for word, gloss in sentence:
+                if word:
+                    _LOOKUP_FREQUENCY[(lexicon_key, spoken_language, signed_language, word, gloss)] += 1
+    _LOOKUP_FREQUENCY_DIRTY.set()
+
+
+def _flush_lookup_frequency():
+    if not _LOOKUP_FREQUENCY_DIRTY.is_set():
+        return
+    with _LOOKUP_FREQUENCY_WRITE_LOCK:
+        _LOOKUP_FREQUENCY_DIRTY.clear()
+        with _LOOKUP_FREQUENCY_LOCK:
+            # Only the most requested entries are kept, so the log does not grow without bound
+            if len(_LOOKUP_FREQUENCY) > LOOKUP_FREQUENCY_MAX_ENTRIES:
+                kept = dict(_LOOKUP_FREQUENCY.most_common(LOOKUP_FREQUENCY_MAX_ENTRIES))
+                _LOOKUP_FREQUENCY.clear()
+                _LOOKUP_FREQUENCY.update(kept)
+            counts = list(_LOOKUP_FREQUENCY.items())
+
+        entries = [
+            {"lexicon": k[0], "spoken_language": k[1], "signed_language": k[2], "word": k[3], "gloss": k[4], "count": c}
+            for k, c in counts
+        ]
+        tmp_path = LOOKUP_FREQUENCY_PATH.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(entries, f)
+        os.replace(tmp_path, LOOKUP_FREQUENCY_PATH)
+
+
+def _flush_lookup_frequency_periodically():
+    while True:
+        time.sleep(LOOKUP_FREQUENCY_FLUSH_SEC)
+        try:
+            _flush_lookup_frequency()
+        except OSError:
+            traceback.print_exc()
+
+
+def _warm_up_entries(lexicon_key: str, top_n: int) -> dict:
+    # The most requested glosses of a lexicon, by (spoken_language, signed_language)
+    with _LOOKUP_FREQUENCY_LOCK:
+        entries = [k for k, _ in _LOOKUP_FREQUENCY.most_common() if k[0] == lexicon_key][:top_n]
+
+    by_language = {}
+    for _, spoken_language, signed_language, word, gloss in entries:
+        by_language.setdefault((spoken_language, signed_language), []).append((word, gloss))
+    return by_language
+
+
+def _pool_warm_up() -> dict:
+    # Every worker process warms up the lexicons requested before as it starts
+    with _LOOKUP_FREQUENCY_LOCK:
+        lexicon_keys = {key[0] for key in _LOOKUP_FREQUENCY}
+    return {lexicon_key: _warm_up_entries(lexicon_key, WARMUP_TOP_N) for lexicon_key in lexicon_keys}
+
+
+# Worker processes with lexicon and transition caches of their own
+_GLOSS_TO_POSE_POOL = None
+if GLOSS_TO_POSE_PROCESSES > 0:
+    _GLOSS_TO_POSE_POOL = GlossToPoseProcessPool(
+        GLOSS_TO_POSE_PROCESSES,
+        poll_interval=LEXICON_POLL_INTERVAL_SEC,
+        cache_directory=POSE_CACHE_DIR,
+        cache_max_bytes=POSE_CACHE_MAX_MB * 1024 * 1024,
+        transition_cache_size=TRANSITION_CACHE_SIZE,
+        warm_up=_pool_warm_up(),
+    )
+
+
+_WARMUP_STATUS = {}
+
+
+def _warm_up(lexicon_key: str, lookup):
+    # Loads the most requested entries of a lexicon into its pose cache, so first requests after a deploy are warm
+    started = time.perf_counter()
+    by_language = _warm_up_entries(lexicon_key, min(WARMUP_TOP_N, lookup.cache.maxsize))
+    entries = sum(len(glosses) for glosses in by_language.values())
+
+    try:
+        for (spoken_language, signed_language), glosses in by_language.items():
+            lookup.prefetch(glosses, spoken_language, signed_language)
+        status = "done"
+    except Exception:
+        traceback.print_exc()
+        status = "failed"
+
+    seconds = round(time.perf_counter() - started, 3)
+    _WARMUP_STATUS[lexicon_key].update(status=status, entries=entries, seconds=seconds, finished=_now_ts())
+    print(f"Lexicon warm-up {status} for {lexicon_key}: {entries} entries in {seconds}s")
+
+
+def _start_warm_up(lexicon_key: str, lookup, restart: bool = False):
+    with _POSE_LOOKUP_LOCK:
+        if lexicon_key in _WARMUP_STATUS and not restart:
+            return
+        _WARMUP_STATUS[lexicon_key] = {"status": "running", "entries": 0, "seconds": None, "finished": None}
+    threading.Thread(target=_warm_up, args=(lexicon_key, lookup), daemon=True).start()
 
 
 def _is_youtube_url(url: str) -> bool:
@@ -457,7 +747,81 @@ def _resolve_max_duration(max_duration_sec: Optional[int]) -> Optional[int]:
     return max_duration_sec
 
 
-def _process_job(
+class _StackSampler:
+    """Samples the stack of a thread every `interval` seconds, counting how often each stack was seen.
+
+    Lookup threads are sampled too while they load an entry, under a `lookup` root, as the thread only waits for them.
+    They are shared, so entries loaded for concurrent jobs are counted as well. The counts are written in the collapsed
+    stack format (one `root;...;leaf count` line per stack), which speedscope and flamegraph.pl read as a flame graph.
+    """
+
+    # The frame lookup threads run each entry in, see `LookupExecutor.map`
+    LOOKUP_TASK = "spoken_to_signed.gloss_to_pose.lookup.executor:LookupExecutor.map.<locals>.run"
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.stacks = Counter()
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+
+    @staticmethod
+    def _stack(frame) -> list:
+        stack = []
+        while frame is not None:
+            stack.append(f"{frame.f_globals.get('__name__', '?')}:{frame.f_code.co_qualname}")
+            frame = frame.f_back
+        return stack[::-1]
+
+    def _run(self):
+        while not self.stopped.wait(self.interval):
+            lookup_threads = {thread.ident for thread in threading.enumerate() if thread.name.startswith("lookup")}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == self.thread_id:
+                    stack = self._stack(frame)
+                elif thread_id in lookup_threads:
+                    stack = self._stack(frame)
+                    if self.LOOKUP_TASK not in stack:
+                        continue
+                    stack = ["lookup", *stack[stack.index(self.LOOKUP_TASK) :]]
+                else:
+                    continue
+                self.stacks[";".join(stack)] += 1
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.stopped.set()
+        self.thread.join()
+
+    def write(self, path: Path):
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+def _process_job(job_id: str, mode: str, *args, profile: bool = False, **kwargs):
+    # Every stage of the job is timed, and the seconds spent in each are kept on the job and in the metrics
+    started = time.perf_counter()
+    sampler = _StackSampler(threading.get_ident(), PROFILE_INTERVAL_SEC) if profile else None
+    with record(exporter=_TRACE_EXPORTER) as trace, sampler or nullcontext():
+        _run_job(job_id, mode, *args, **kwargs)
+    timings = trace.durations()
+    _update_job(job_id, timings=timings)
+    if sampler is not None:
+        sampler.write(RUNS_DIR / job_id / "profile.txt")
+        _update_job(job_id, profile=f"/files/{job_id}/profile.txt")
+
+    with JOBS_LOCK:
+        status = JOBS[job_id]["status"] if job_id in JOBS else "failed"
+    _inc("spoken_jobs_total", mode=mode, status=status)
+    _observe("spoken_job_duration_seconds", time.perf_counter() - started, mode=mode)
+    for stage, seconds in timings.items():
+        _observe("spoken_job_stage_seconds", seconds, stage=stage)
+
+
+def _run_job(
     job_id: str,
     mode: str,
     text: Optional[str],
@@ -471,6 +835,7 @@ def _process_job(
     prefer_captions: bool = True,
     caption_language: Optional[str] = None,
     max_duration_sec: Optional[int] = None,
+    config: PipelineConfig = PIPELINE_CONFIG,
 ):
     current_step = "receive_input"
     try:
@@ -487,7 +852,8 @@ def _process_job(
             if not _is_youtube_url(youtube_url):
                 raise RuntimeError("Invalid YouTube URL.")
 
-            info = _get_youtube_info(youtube_url)
+            with span("youtube_info"):
+                info = _get_youtube_info(youtube_url)
             duration = info.get("duration")
             max_duration = _resolve_max_duration(max_duration_sec)
             if max_duration and duration and duration > max_duration:
@@ -495,7 +861,8 @@ def _process_job(
 
             caption_text = None
             if prefer_captions:
-                caption_text = _download_caption_text(info, caption_language or spoken_language)
+                with span("download_captions"):
+                    caption_text = _download_caption_text(info, caption_language or spoken_language)
 
             if caption_text:
                 transcript = caption_text
@@ -505,7 +872,8 @@ def _process_job(
             else:
                 job_dir = RUNS_DIR / job_id
                 job_dir.mkdir(parents=True, exist_ok=True)
-                input_path = _download_youtube_audio(youtube_url, job_dir / "input")
+                with span("download_audio"):
+                    input_path = _download_youtube_audio(youtube_url, job_dir / "input")
                 effective_mode = "audio"
 
         if effective_mode in {"audio", "video"}:
@@ -518,9 +886,11 @@ def _process_job(
             audio_path = input_path
             if effective_mode == "video":
                 audio_path = input_path.with_suffix(".wav")
-                _extract_audio(input_path, audio_path)
+                with span("extract_audio"):
+                    _extract_audio(input_path, audio_path)
 
-            transcript = _transcribe_audio(audio_path, spoken_language)
+            with span("transcribe"):
+                transcript = _transcribe_audio(audio_path, spoken_language)
             _set_step(job_id, "transcribe", "done")
             _set_progress(job_id, 35)
         else:
@@ -534,7 +904,8 @@ def _process_job(
         current_step = "text_to_gloss"
         _set_step(job_id, "text_to_gloss", "running")
         _set_progress(job_id, 40)
-        sentences = _text_to_gloss(transcript, spoken_language, glosser, signed_language)
+        with span("text_to_gloss"):
+            sentences = _text_to_gloss(transcript, spoken_language, glosser, signed_language)
         gloss_string = _glosses_to_string(sentences)
         _set_step(job_id, "text_to_gloss", "done")
         _set_progress(job_id, 55)
@@ -542,9 +913,9 @@ def _process_job(
         current_step = "gloss_to_pose"
         _set_step(job_id, "gloss_to_pose", "running")
         _set_progress(job_id, 65)
-        pose = _gloss_to_pose(sentences, lexicon, spoken_language, signed_language)
+        pose = _gloss_to_pose(sentences, lexicon, spoken_language, signed_language, config)
         pose_path = RUNS_DIR / job_id / "output.pose"
-        with open(pose_path, "wb") as f:
+        with span("write_pose"), open(pose_path, "wb") as f:
             pose.write(f)
         _set_step(job_id, "gloss_to_pose", "done")
         _set_progress(job_id, 80)
@@ -554,21 +925,27 @@ def _process_job(
         _set_progress(job_id, 90)
         video_path = RUNS_DIR / job_id / "output.mp4"
         style = "clean" if avatar_type == "skeleton" else "avatar"
-        pose_to_skeleton_video(
-            pose_path=str(pose_path),
-            video_path=str(video_path),
-            fps=0,
-            width=640,
-            height=480,
-            style=style,
-            female=False,
-        )
+        started = time.perf_counter()
+        with span("render_video"):
+            pose_to_skeleton_video(
+                pose_path=str(pose_path),
+                video_path=str(video_path),
+                fps=0,
+                width=640,
+                height=480,
+                style=style,
+                female=False,
+            )
+        frames = len(pose.body.data)
+        _inc("spoken_render_frames_total", frames)
+        _observe("spoken_render_fps", frames / max(time.perf_counter() - started, 1e-9))
         _set_step(job_id, "render_video", "done")
         _set_progress(job_id, 100)
 
         result = {
             "text": transcript,
             "gloss": gloss_string,
+            "keypoint_profile": config.keypoint_profile,
             "files": {
                 "pose": f"/files/{job_id}/output.pose",
                 "video": f"/files/{job_id}/output.mp4",
@@ -581,11 +958,60 @@ def _process_job(
         traceback.print_exc()
 
 
+@app.on_event("startup")
+def warm_up_lexicons():
+    threading.Thread(target=_flush_lookup_frequency_periodically, daemon=True).start()
+    # Building a lookup starts its warm-up, do it for every lexicon that was requested before
+    if _GLOSS_TO_POSE_POOL is not None:
+        # Lookups happen in the worker processes, which warm up as soon as they start
+        threading.Thread(target=_GLOSS_TO_POSE_POOL.start, daemon=True).start()
+        return
+    with _LOOKUP_FREQUENCY_LOCK:
+        lexicons = {Path(key[0]) for key in _LOOKUP_FREQUENCY}
+    lexicons.add(DEFAULT_LEXICON)
+    for lexicon in lexicons:
+        if (lexicon / "index.csv").exists():
+            threading.Thread(target=_get_pose_lookup, args=(lexicon,), daemon=True).start()
+
+
+@app.on_event("shutdown")
+def flush_lookup_frequency():
+    _flush_lookup_frequency()
+
+
+@app.on_event("shutdown")
+def stop_gloss_to_pose_pool():
+    if _GLOSS_TO_POSE_POOL is not None:
+        _GLOSS_TO_POSE_POOL.shutdown()
+
+
 @app.get("/health")
 def health():
     return {"ok": True}
 
 
+@app.get("/warmup")
+def warmup_status():
+    return _WARMUP_STATUS
+
+
+@app.get("/lookups")
+def lookup_executor_status():
+    return _LOOKUP_EXECUTOR.stats()
+
+
+@app.get("/transitions")
+def transition_cache_status():
+    if _TRANSITION_CACHE is None:
+        return {"enabled": False}
+    return {"enabled": True, **_TRANSITION_CACHE.stats()}
+
+
+@app.get("/metrics")
+def metrics():
+    return PlainTextResponse(_render_metrics(), media_type="text/plain; version=0.0.4")
+
+
 @app.post("/recognize")
 async def recognize(file: UploadFile = File(...)):
     try:
@@ -594,7 +1020,10 @@ async def recognize(file: UploadFile = File(...)):
             raise HTTPException(status_code=400, detail="Empty file.")
         arr = _prepare_image(data)
         model = _get_model()
+        started = time.perf_counter()
         preds = model.predict(arr, verbose=0)[0]
+        _observe("spoken_recognize_seconds", time.perf_counter() - started)
+        _observe("spoken_recognize_batch_size", len(arr))
         if preds is None or len(preds) == 0:
             raise HTTPException(status_code=500, detail="Model returned empty output.")
         class_names = _get_class_names()
@@ -643,13 +1072,21 @@ async def create_job(
     glosser: str = Form("simple"),
     avatar_type: str = Form("skeleton"),
     lexicon: Optional[str] = Form(None),
+    keypoint_profile: Optional[str] = Form(None),
+    profile: bool = Form(False),
+    x_admin_token: Optional[str] = Header(None),
 ):
+    keypoint_profile = keypoint_profile or PIPELINE_CONFIG.keypoint_profile
+    if profile and not (ADMIN_TOKEN and x_admin_token and hmac.compare_digest(x_admin_token, ADMIN_TOKEN)):
+        raise HTTPException(status_code=403, detail="Profiling a job requires the admin token.")
     if mode not in ALLOWED_MODES:
         raise HTTPException(status_code=400, detail=f"Unsupported mode: {mode}")
     if glosser not in ALLOWED_GLOSSERS:
         raise HTTPException(status_code=400, detail=f"Unsupported glosser: {glosser}")
     if avatar_type not in ALLOWED_AVATARS:
         raise HTTPException(status_code=400, detail=f"Unsupported avatar type: {avatar_type}")
+    if keypoint_profile not in KEYPOINT_PROFILES:
+        raise HTTPException(status_code=400, detail=f"Unsupported keypoint profile: {keypoint_profile}")
 
     if mode == "text" and not (text or "").strip():
         raise HTTPException(status_code=400, detail="Text input is required for text mode.")
@@ -690,6 +1127,8 @@ async def create_job(
         "steps": _make_steps(),
         "result": None,
         "error": None,
+        "timings": None,
+        "profile": None,
     }
     with JOBS_LOCK:
         JOBS[job_id] = job
@@ -709,6 +1148,8 @@ async def create_job(
         prefer_captions,
         caption_language,
         max_duration_sec,
+        PIPELINE_CONFIG._replace(keypoint_profile=keypoint_profile),
+        profile=profile,
     )
 
     return job